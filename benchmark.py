@@ -0,0 +1,602 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+#!/usr/bin/env python
+
+import sys
+import os
+import random
+import time
+import mailbox
+import optparse
+import simplejson as json
+import email.utils
+import threading
+import bisect
+import calendar
+import datetime
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import summarize
+
+noise_subjects = [ "Build failure on Mozilla-Inbound",
+                   "Re: Tree closure",
+                   "Talos Regression :( Unknown Test increase 1.2% on XP Mozilla-Inbound",
+                   "[Bug 123456] Intermittent failure in test_foo.html" ]
+
+def random_node(rng):
+    return '%040x' % rng.getrandbits(160)
+
+def generate_pushlog(rng, n_pushes, start_time):
+    pushes = []
+    t = start_time
+    for i in range(n_pushes):
+        t += rng.randint(60, 3600)
+        pushes.append((str(i + 1), t, random_node(rng)))
+    return pushes
+
+def json_pushes_for(pushes, i, j):
+    # json-pushes?fromchange=X&tochange=Y excludes X and includes Y.
+    return json_pushes_of(pushes[i+1:j+1])
+
+def json_pushes_of(pushes):
+    d = {}
+    for (pushid, date, node) in pushes:
+        d[pushid] = { 'date': date, 'changesets': [node], 'user': 'someone' }
+    return json.dumps(d)
+
+def talos_subject(rng, test, platform, sign):
+    if sign == '+':
+        kind, direction = "Regression :(", "increase"
+    else:
+        kind, direction = "Improvement!", "decrease"
+    tree = rng.choice(["Mozilla-Inbound", "Mozilla-Inbound-Non-PGO"])
+    amount = "%.1f" % rng.uniform(0.5, 15.0)
+    return "Talos %s %s %s %s%% on %s %s" % (kind, test, direction, amount,
+                                             platform, tree)
+
+def write_message(f, sender, to, subject, date, body):
+    f.write("From %s %s\n" % (sender, time.asctime(time.gmtime(date))))
+    f.write("From: %s\n" % sender)
+    f.write("To: %s\n" % to)
+    f.write("Subject: %s\n" % subject)
+    f.write("Date: %s\n" % email.utils.formatdate(date))
+    f.write("\n")
+    f.write(body)
+    f.write("\n")
+
+def generate_mbox(path, n_messages, pushes, noise_ratio=0.95,
+                  max_range=20, tests=None, platforms=None, seed=0):
+    """Write a synthetic dev-tree-management archive to PATH and return a
+    dict from the (fromindex, toindex) push ranges it references to the
+    date of the first message about each."""
+    rng = random.Random(seed)
+    if tests is None:
+        tests = summarize.all_talos_test_descriptions
+    if platforms is None:
+        platforms = summarize.platforms
+    messages = []
+    for n in range(n_messages):
+        i = rng.randint(0, len(pushes) - 2)
+        if rng.random() < noise_ratio:
+            to = rng.choice(["dev-tree-management@lists.mozilla.org",
+                             "dev-platform@lists.mozilla.org"])
+            messages.append((pushes[i][1] + rng.randint(0, 7200), "noise@mozilla.org", to,
+                             rng.choice(noise_subjects), "Nothing to see here.\n", None))
+            continue
+        j = min(len(pushes) - 1, i + rng.randint(1, max_range))
+        # A Talos mail goes out once the push at the end of its range has
+        # been tested enough to tell, which can take a couple of days.
+        date = pushes[j][1] + rng.randint(1800, 2 * 86400)
+        test = rng.choice(tests)
+        platform = rng.choice(platforms)
+        sign = rng.choice(['+', '-'])
+        pushloghtml = summarize.m_i_pushloghtml % (pushes[i][2][:12],
+                                                   pushes[j][2][:12])
+        body = "Regression detected.\n\nChangeset range: %s\n" % pushloghtml
+        messages.append((date, "nobody@cruncher.build.mozilla.org",
+                         "dev-tree-management@lists.mozilla.org",
+                         talos_subject(rng, test, platform, sign), body, (i, j)))
+    # Mail is archived in the order it arrives.
+    messages.sort(key=lambda m: m[0])
+    ranges = {}
+    with open(path, 'w') as f:
+        for (date, sender, to, subject, body, r) in messages:
+            write_message(f, sender, to, subject, date, body)
+            if r is not None and r not in ranges:
+                ranges[r] = date
+    return ranges
+
+def generate_json_cache(path, pushes, ranges):
+    if os.path.exists(path):
+        os.remove(path)
+    cache = summarize.JSONCache(path)
+    for (i, j) in ranges:
+        cache.store(pushes[i][2][:12] + pushes[j][2][:12],
+                    summarize.push_boundaries_from_json(json_pushes_for(pushes, i, j)))
+    cache.save()
+
+class PushlogServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local stand-in for hg.mozilla.org that answers json-pushes queries
+    from a synthetic pushlog, taking LATENCY seconds per request."""
+    daemon_threads = True
+    def __init__(self, pushes, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), PushlogHandler)
+        self.pushes = pushes
+        self.push_index = dict([(node[:12], i) for (i, (pushid, date, node)) in enumerate(pushes)])
+        self.push_dates = [date for (pushid, date, node) in pushes]
+        self.latency = latency
+        self.n_requests = 0
+        self.n_range_requests = 0
+        self.lock = threading.Lock()
+    def tree(self):
+        """A mozilla-inbound whose pushlog is served by this server."""
+        return summarize.Tree('mozilla-inbound', 'Mozilla-Inbound',
+                              'integration/mozilla-inbound',
+                              "http://127.0.0.1:%d/" % self.server_address[1])
+
+class PushlogHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write rather than trickling out headers.
+    wbufsize = -1
+    def do_GET(self):
+        with self.server.lock:
+            self.server.n_requests += 1
+        time.sleep(self.server.latency)
+        query = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+        if 'startdate' in query:
+            # Whole days, taken as UTC.  time.strptime isn't safe to call
+            # from several threads at once on Python 2.
+            (start, end) = [calendar.timegm(datetime.date(*map(int, query[name][0].split('-'))).timetuple())
+                            for name in ('startdate', 'enddate')]
+            body = json_pushes_of(self.server.pushes[bisect.bisect_left(self.server.push_dates, start):
+                                                     bisect.bisect_left(self.server.push_dates, end)])
+        else:
+            with self.server.lock:
+                self.server.n_range_requests += 1
+            i = self.server.push_index.get(query.get('fromchange', [''])[0])
+            j = self.server.push_index.get(query.get('tochange', [''])[0])
+            if i is None or j is None:
+                self.send_error(404)
+                return
+            body = json_pushes_for(self.server.pushes, i, j)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args):
+        pass
+
+def time_pushlog_prefetch(workdir, pushes, ranges, latency, jobs_list):
+    """Time prefetching RANGES into a cold cache with each number of jobs in
+    JOBS_LIST, first asking for every range on its own and then, with the
+    most jobs, letting the cache fetch whole days of pushes around the
+    messages.  RANGES maps each range to the date of its first message.
+    The results are keyed by (jobs, planned), and each is the seconds
+    taken, the number of requests made and how many of those were for a
+    single range, which for the planned fetch are the ranges the whole
+    days fetched didn't cover."""
+    server = PushlogServer(pushes, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    tree = server.tree()
+    node_ranges = [(tree, pushes[i][2][:12], pushes[j][2][:12],
+                    datetime.datetime.utcfromtimestamp(date))
+                   for ((i, j), date) in sorted(ranges.items())]
+    results = {}
+    try:
+        for (jobs, planned) in [(jobs, False) for jobs in jobs_list] + [(max(jobs_list), True)]:
+            cache_file = os.path.join(workdir, '.prefetch_cache')
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            cache = summarize.JSONCache(cache_file)
+            server.n_requests = 0
+            server.n_range_requests = 0
+            start = time.time()
+            if planned:
+                cache.prefetch(node_ranges, jobs)
+            else:
+                cache.prefetch([r[:3] + (None,) for r in node_ranges], jobs)
+            results[(jobs, planned)] = (time.time() - start, server.n_requests,
+                                        server.n_range_requests)
+            cache.save()
+    finally:
+        server.shutdown()
+    return results
+
+def count_coalesced_requests(workdir, pushes, ranges, latency, n_threads):
+    """Look up RANGES from N_THREADS threads at once against a cold cache,
+    each thread in its own order, and return the number of requests the
+    server saw along with the number of distinct ranges."""
+    server = PushlogServer(pushes, latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    tree = server.tree()
+    node_ranges = [(tree, pushes[i][2][:12], pushes[j][2][:12]) for (i, j) in ranges]
+    cache_file = os.path.join(workdir, '.coalescing_cache')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    cache = summarize.JSONCache(cache_file)
+
+    def worker(seed):
+        fetcher = cache.new_fetcher()
+        mine = list(node_ranges)
+        random.Random(seed).shuffle(mine)
+        for r in mine:
+            cache.fetch(fetcher, *r)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        server.shutdown()
+    cache.save()
+    return (server.n_requests, len(set(ranges)))
+
+def time_pushlog_mirror(workdir, pushes, ranges):
+    """Time importing a dump of the whole pushlog into a cold cache, then
+    looking up RANGES from it alone.  Return the two times and the number
+    of ranges whose boundaries differ from what json-pushes gives."""
+    dump_file = os.path.join(workdir, 'pushlog.json')
+    with open(dump_file, 'w') as f:
+        f.write(json_pushes_of(pushes))
+    cache_file = os.path.join(workdir, '.mirror_cache')
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    cache = summarize.JSONCache(cache_file)
+    tree = summarize.default_tree
+    start = time.time()
+    with open(dump_file, 'r') as f:
+        cache.import_pushlog(tree, json.load(f))
+    import_time = time.time() - start
+
+    start = time.time()
+    n_wrong = 0
+    for (i, j) in ranges:
+        boundaries = cache.push_boundaries(tree, pushes[i][2][:12], pushes[j][2][:12])
+        if boundaries != summarize.push_boundaries_from_json(json_pushes_for(pushes, i, j)):
+            n_wrong += 1
+    lookup_time = time.time() - start
+    cache.save()
+    return (import_time, lookup_time, n_wrong)
+
+def date_range_for(pushes):
+    fmt = "%d/%m/%Y"
+    # Mail about the last pushes can come up to two days after them.
+    return "%s-%s" % (time.strftime(fmt, time.gmtime(pushes[0][1])),
+                      time.strftime(fmt, time.gmtime(pushes[-1][1] + 3 * 86400)))
+
+def per_test_loop(mbox, tests):
+    for msg in mbox.itervalues():
+        for t in tests:
+            if t.process_message(msg):
+                break
+
+def dispatched_loop(mbox, tests):
+    dispatcher = summarize.MessageDispatcher(tests)
+    for msg in mbox.itervalues():
+        dispatcher.process_message(msg)
+    dispatcher.finish()
+
+def time_subject_matching(mbox_file, cache_file, date_range):
+    summarize.json_cache = summarize.JSONCache(cache_file)
+    results = {}
+    for (name, loop) in [('per-test', per_test_loop),
+                         ('dispatched', dispatched_loop)]:
+        tests = [summarize.TalosTest(t, date_range)
+                 for t in summarize.all_talos_test_descriptions]
+        start = time.time()
+        loop(mailbox.mbox(mbox_file), tests)
+        elapsed = time.time() - start
+        results[name] = (elapsed, sum([t.n_emails for t in tests]))
+    return results
+
+def time_parallel_scan(mbox_file, date_range, jobs_list):
+    """Time scanning MBOX_FILE into records on one process and then split
+    into pieces across each number of jobs in JOBS_LIST, returning a dict
+    from jobs to the seconds taken and whether the records were the same as
+    one process found."""
+    tests = [summarize.TalosTest(t, date_range)
+             for t in summarize.all_talos_test_descriptions]
+    dispatcher = summarize.MessageDispatcher(tests)
+    criteria = dispatcher.criteria()
+    results = {}
+    start = time.time()
+    serial = [summarize.extract_record(msg, *criteria)
+              for msg in summarize.scan_mailboxes([(mbox_file, 0, None)], *criteria[:3])]
+    serial = [record for record in serial if record is not None]
+    results[1] = (time.time() - start, True)
+    for jobs in jobs_list:
+        start = time.time()
+        pieces = summarize.mbox_pieces(mbox_file, jobs * 4)
+        records = list(summarize.scan_mailbox_records(pieces, criteria, jobs))
+        results[jobs] = (time.time() - start, records == serial)
+    return results
+
+class StageTimer:
+    """Accumulate the wall time spent in each named stage, remembering the
+    order the stages were first entered in."""
+    def __init__(self):
+        self.order = []
+        self.times = {}
+    def time(self, stage, f, *args):
+        start = time.time()
+        result = f(*args)
+        if stage not in self.times:
+            self.order.append(stage)
+            self.times[stage] = 0.0
+        self.times[stage] += time.time() - start
+        return result
+
+def time_stages(mbox_file, cache_file, date_range):
+    """Run the pipeline over MBOX_FILE one stage at a time, returning a list
+    of (stage, seconds) pairs and a dict of counts."""
+    summarize.json_cache = summarize.JSONCache(cache_file)
+    tests = [summarize.TalosTest(t, date_range)
+             for t in summarize.all_talos_test_descriptions]
+    dispatcher = summarize.MessageDispatcher(tests)
+    timer = StageTimer()
+
+    candidates = timer.time('mbox scan', list,
+                            summarize.scan_mbox_messages(mbox_file, dispatcher.begin_date,
+                                                         dispatcher.end_date,
+                                                         dispatcher.subject_regex))
+
+    def match():
+        for msg in candidates:
+            dispatcher.process_message(msg)
+    timer.time('subject matching', match)
+
+    def lookup():
+        for (test, record) in dispatcher.pending:
+            test.add_record(record)
+    timer.time('pushlog lookup', lookup)
+
+    structures = []
+    for t in tests:
+        timer.time('insert_info_into_list', t.insert_pending)
+        timer.time('end', t.end)
+        if len(t.changes) == 0:
+            continue
+        platforms = sorted(summarize.collect_platforms(t.changes))
+        structure = timer.time('table layout', summarize.build_table_structure,
+                               platforms, t.changes)
+        structures.append((platforms, structure))
+
+    def render():
+        for (platforms, structure) in structures:
+            summarize.output_header_row(platforms)
+            for r in structure:
+                r.output_html()
+            summarize.output_summary_rows(platforms, structure)
+    timer.time('HTML rendering', render)
+    summarize.json_cache.save()
+
+    counts = { 'candidates': len(candidates),
+               'emails': sum([t.n_emails for t in tests]),
+               'ranges': sum([len(t.changes) for t in tests]),
+               'rows': sum([len(structure) for (platforms, structure) in structures]) }
+    return ([(stage, timer.times[stage]) for stage in timer.order], counts)
+
+def random_interval_specs(rng, n_ranges, n_pushes):
+    """Random (fromindex, toindex, platform, sign, amount) ranges over a
+    pushlog of N_PUSHES pushes, including the degenerate ranges that
+    exercise insert_info_into_list's stranger cases."""
+    specs = []
+    for n in range(n_ranges):
+        i = rng.randint(0, n_pushes - 1)
+        j = min(n_pushes - 1, i + rng.randint(0, 10))
+        specs.append((i, j, rng.choice(summarize.platforms),
+                      rng.choice(['+', '-']), round(rng.uniform(0.5, 15.0), 1)))
+    return specs
+
+def change_informations(specs, pushes):
+    infos = []
+    for (i, j, platform, sign, amount) in specs:
+        deltas = frozenset([summarize.TalosDelta(sign, amount, platform)])
+        ci = summarize.ChangeInformation(deltas, pushes[i][2][:12],
+                                         pushes[j][2][:12])
+        ci.fromchange.date = pushes[i][1]
+        ci.tochange.date = pushes[j][1]
+        infos.append(ci)
+    return infos
+
+def describe_changes(changes):
+    return [(c.fromchange.node_id, c.tochange.node_id,
+             sorted([str(d) for d in c.deltas])) for c in changes]
+
+def check_interval_index(rng, n_trials):
+    """Insert random interval sets with both insert_info_into_list and
+    insert_info_into_index and return the number of trials whose
+    resulting ranges differ."""
+    failures = 0
+    for n in range(n_trials):
+        # Few pushes, some sharing a date, so ranges collide often.
+        n_pushes = rng.randint(2, 40)
+        pushes = [(str(k), 1325376000 + 60 * rng.randint(0, n_pushes),
+                   random_node(rng)) for k in range(n_pushes)]
+        pushes.sort(key=lambda p: p[1])
+        specs = random_interval_specs(rng, rng.randint(1, 60), n_pushes)
+        # Push ids sort as strings, so some ranges end before they start.
+        specs = [(j, i) + spec[2:] if rng.random() < 0.1 else spec
+                 for spec in specs for (i, j) in [spec[:2]]]
+
+        expected = []
+        for info in change_informations(specs, pushes):
+            summarize.insert_info_into_list(info, expected)
+        index = summarize.ChangeIndex()
+        for info in change_informations(specs, pushes):
+            summarize.insert_info_into_index(info, index)
+
+        if describe_changes(expected) != describe_changes(index):
+            failures += 1
+    return failures
+
+def time_interval_insertion(rng, n_ranges, n_pushes):
+    pushes = generate_pushlog(rng, n_pushes, 1325376000)
+    specs = random_interval_specs(rng, n_ranges, n_pushes)
+    results = {}
+    for (name, insert, changes) in [('list', summarize.insert_info_into_list, []),
+                                    ('index', summarize.insert_info_into_index,
+                                     summarize.ChangeIndex())]:
+        infos = change_informations(specs, pushes)
+        start = time.time()
+        for info in infos:
+            insert(info, changes)
+        results[name] = (time.time() - start, len(changes))
+    return results
+
+def build_option_parser():
+    usage = "usage: %prog [options] work-directory"
+    parser = optparse.OptionParser(usage=usage)
+
+    parser.add_option("-n", "--messages", metavar="N",
+                      action="store", type="int", dest="n_messages",
+                      help="number of messages in the synthetic mbox",
+                      default=100000)
+    parser.add_option("-p", "--pushes", metavar="N",
+                      action="store", type="int", dest="n_pushes",
+                      help="number of pushes in the synthetic pushlog",
+                      default=5000)
+    parser.add_option("--noise", metavar="RATIO",
+                      action="store", type="float", dest="noise_ratio",
+                      help="fraction of non-Talos messages",
+                      default=0.95)
+    parser.add_option("--tests", metavar="N",
+                      action="store", type="int", dest="n_tests",
+                      help="number of distinct Talos tests in the synthetic mail",
+                      default=len(summarize.all_talos_test_descriptions))
+    parser.add_option("--platforms", metavar="N",
+                      action="store", type="int", dest="n_platforms",
+                      help="number of distinct platforms in the synthetic mail",
+                      default=len(summarize.platforms))
+    parser.add_option("--max-range", metavar="N",
+                      action="store", type="int", dest="max_range",
+                      help="largest number of pushes in a changeset range; larger ranges overlap more",
+                      default=20)
+    parser.add_option("--seed", metavar="SEED",
+                      action="store", type="int", dest="seed",
+                      help="random seed for the generated data",
+                      default=0)
+    parser.add_option("--ranges", metavar="N",
+                      action="store", type="int", dest="n_ranges",
+                      help="number of ranges to insert when timing interval insertion",
+                      default=2000)
+    parser.add_option("--check-trials", metavar="N",
+                      action="store", type="int", dest="check_trials",
+                      help="random interval sets to check the interval index against",
+                      default=200)
+    parser.add_option("--latency", metavar="SECONDS",
+                      action="store", type="float", dest="latency",
+                      help="simulated latency of each pushlog request",
+                      default=0.02)
+    parser.add_option("--stages-only", action="store_true", dest="stages_only",
+                      help="only time the stages of the pipeline, skipping the comparisons",
+                      default=False)
+    parser.add_option("--json", metavar="FILE",
+                      action="store", type="string", dest="json_file",
+                      help="also write the results as JSON to FILE",
+                      default=None)
+
+    return parser
+
+def main():
+    (options, argv) = build_option_parser().parse_args()
+    workdir = argv[0]
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    mbox_file = os.path.join(workdir, 'dev-tree-management.mbox')
+    cache_file = os.path.join(workdir, '.json_cache')
+
+    rng = random.Random(options.seed)
+    pushes = generate_pushlog(rng, options.n_pushes, 1325376000)
+    ranges = generate_mbox(mbox_file, options.n_messages, pushes,
+                           noise_ratio=options.noise_ratio,
+                           max_range=options.max_range,
+                           tests=summarize.all_talos_test_descriptions[:options.n_tests],
+                           platforms=summarize.platforms[:options.n_platforms],
+                           seed=options.seed)
+    generate_json_cache(cache_file, pushes, ranges)
+    date_range = date_range_for(pushes)
+    print 'generated %d messages, date range %s' % (options.n_messages, date_range)
+
+    report = { 'parameters': { 'messages': options.n_messages,
+                               'pushes': options.n_pushes,
+                               'noise_ratio': options.noise_ratio,
+                               'tests': options.n_tests,
+                               'platforms': options.n_platforms,
+                               'max_range': options.max_range,
+                               'seed': options.seed } }
+
+    (stages, counts) = time_stages(mbox_file, cache_file, date_range)
+    for (stage, elapsed) in stages:
+        print '%s: %.3fs' % (stage, elapsed)
+    print '%(candidates)d candidates, %(emails)d emails, %(ranges)d ranges, %(rows)d rows' % counts
+    report['stages'] = [{ 'stage': stage, 'seconds': elapsed } for (stage, elapsed) in stages]
+    report['counts'] = counts
+
+    if not options.stages_only:
+        comparisons = {}
+        results = time_subject_matching(mbox_file, cache_file, date_range)
+        for name in ['per-test', 'dispatched']:
+            (elapsed, n_emails) = results[name]
+            print '%s: %.2fs, %d emails matched' % (name, elapsed, n_emails)
+            comparisons['subject matching, %s' % name] = elapsed
+
+        results = time_parallel_scan(mbox_file, date_range, [2, 4])
+        for jobs in sorted(results.keys()):
+            (elapsed, same) = results[jobs]
+            print 'scan into records, %d jobs: %.2fs%s' % (jobs, elapsed,
+                                                           '' if same else ', RECORDS DIFFER')
+            comparisons['scan into records, %d jobs' % jobs] = elapsed
+            report.setdefault('parallel_scan_differs', []).extend([] if same else [jobs])
+
+        results = time_pushlog_prefetch(workdir, pushes, ranges, options.latency, [1, 8])
+        for (jobs, planned) in sorted(results.keys()):
+            (elapsed, n_requests, n_range_requests) = results[(jobs, planned)]
+            name = 'prefetch, %d jobs' % jobs
+            if planned:
+                name += ', whole days'
+                print '%s: %.2fs, %d requests, %d ranges not covered by the days fetched' % (
+                    name, elapsed, n_requests, n_range_requests)
+                report['prefetch_ranges_missed'] = n_range_requests
+            else:
+                print '%s: %.2fs, %d requests' % (name, elapsed, n_requests)
+            comparisons[name] = elapsed
+        (import_time, lookup_time, n_wrong) = time_pushlog_mirror(workdir, pushes, ranges)
+        print 'pushlog mirror: import %.2fs, %d lookups %.2fs, %d wrong' % (import_time, len(ranges),
+                                                                            lookup_time, n_wrong)
+        comparisons['pushlog mirror import'] = import_time
+        comparisons['pushlog mirror lookups'] = lookup_time
+        report['pushlog_mirror_wrong'] = n_wrong
+        (n_requests, n_unique) = count_coalesced_requests(workdir, pushes, sorted(ranges)[:200],
+                                                          options.latency, 8)
+        print 'concurrent lookups from 8 threads: %d requests for %d ranges' % (n_requests, n_unique)
+        report['coalesced_requests'] = { 'requests': n_requests, 'ranges': n_unique }
+
+        failures = check_interval_index(random.Random(options.seed), options.check_trials)
+        print 'interval index: %d of %d random interval sets differ' % (failures, options.check_trials)
+        report['interval_index_failures'] = failures
+        results = time_interval_insertion(random.Random(options.seed),
+                                          options.n_ranges, options.n_pushes)
+        for name in ['list', 'index']:
+            (elapsed, n_ranges) = results[name]
+            print 'insert into %s: %.2fs, %d ranges' % (name, elapsed, n_ranges)
+            comparisons['insert into %s' % name] = elapsed
+        report['comparisons'] = comparisons
+
+    if options.json_file is not None:
+        with open(options.json_file, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -5,26 +5,98 @@
 #!/usr/bin/env python
 
 import sys
+import os
 import re
 import mailbox
 import string
 import rfc822
 import time
 import datetime
-import urllib2
+import urlparse
+import httplib
+import socket
+import threading
+import Queue
 import simplejson as json
 import cPickle
+import sqlite3
 import optparse
+import email.parser
+import mmap
+import bisect
+import multiprocessing
+import cStringIO
+import contextlib
+import csv
+import copy
+import glob
+import gzip
+import bz2
+import urllib
+import hashlib
+import BaseHTTPServer
+import SocketServer
+
+# NumPy makes the table statistics faster, but isn't required.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Only needed to read mailboxes compressed with xz.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+hg_url = "https://hg.mozilla.org/"
+
+class Tree:
+    """A repository whose Talos results are mailed to the list.
+    SUBJECT_NAME is how the tree appears at the end of a Talos subject and
+    REPO is its path on hg.mozilla.org."""
+    def __init__(self, name, subject_name, repo, base_url=hg_url):
+        self.name = name
+        self.subject_name = subject_name
+        self.json_pushes_url = base_url + repo + "/json-pushes?fromchange=%s&tochange=%s"
+        self.json_pushes_by_date_url = base_url + repo + "/json-pushes?startdate=%s&enddate=%s"
+        self.pushloghtml = base_url + repo + "/pushloghtml?fromchange=%s&tochange=%s"
+        self.rev = base_url + repo + "/rev/%s"
+        # Older mails link to the pushlog over http, newer ones over https.
+        location = (base_url + repo).split('://', 1)[1]
+        self.changeset_range_re = re.compile(r"Changeset range: https?://" + re.escape(location) +
+                                             r"/pushloghtml\?fromchange=([0-9a-f]{12,})&tochange=([0-9a-f]{12,})")
+    def cache_key(self, fromchange, tochange):
+        # Ranges were cached for mozilla-inbound alone before there were
+        # other trees, so its keys stay unadorned.
+        key = fromchange + tochange
+        if self.name != 'mozilla-inbound':
+            key = self.name + ':' + key
+        return key
+
+all_trees = [ Tree('mozilla-inbound', 'Mozilla-Inbound', 'integration/mozilla-inbound'),
+              Tree('mozilla-central', 'Firefox', 'mozilla-central'),
+              Tree('fx-team', 'Fx-Team', 'integration/fx-team'),
+              Tree('mozilla-aurora', 'Mozilla-Aurora', 'releases/mozilla-aurora'),
+              Tree('mozilla-beta', 'Mozilla-Beta', 'releases/mozilla-beta') ]
 
-m_i_json_pushes_url = "http://hg.mozilla.org/integration/mozilla-inbound/json-pushes?fromchange=%s&tochange=%s"
-m_i_pushloghtml = "http://hg.mozilla.org/integration/mozilla-inbound/pushloghtml?fromchange=%s&tochange=%s"
-m_i_rev = "http://hg.mozilla.org/integration/mozilla-inbound/rev/%s"
+trees_by_name = dict([(t.name, t) for t in all_trees])
+default_tree = trees_by_name['mozilla-inbound']
 
-subject_percent_change_re = re.compile("^Talos (?:Regression|Improvement).*?(de|in)crease ([0-9]+(?:\\.[0-9]+(?:e\\+[0-9]+)?)?)%", re.DOTALL)
-changeset_range_re = re.compile(r"Changeset range: http://hg.mozilla.org/integration/mozilla-inbound/pushloghtml\?fromchange=([0-9a-f]{12,})&tochange=([0-9a-f]{12,})")
+m_i_json_pushes_url = default_tree.json_pushes_url
+m_i_pushloghtml = default_tree.pushloghtml
+m_i_rev = default_tree.rev
+
+subject_percent_change_re = re.compile("^Talos (Regression|Improvement).*?(de|in)crease ([0-9]+(?:\\.[0-9]+(?:e\\+[0-9]+)?)?)%", re.DOTALL)
+changeset_range_re = default_tree.changeset_range_re
 
 json_cache = None
 
+list_address_prefix = 'dev-tree-management@'
+
 platforms = ['XP', 'Win7', 'MacOSX 10.6 (rev4)', 'Linux x64', 'Linux',
              'WINNT 5.2', 'WINNT 6.1',
              'CentOS release 5 (Final)', 'CentOS (x86_64) release 5 (Final)',
@@ -32,33 +104,30 @@ platforms = ['XP', 'Win7', 'MacOSX 10.6 (rev4)', 'Linux x64', 'Linux',
 
 msg_template = string.Template("${strtime} ${sign}${amount}% from ${fromchange} to ${tochange}")
 
-class Revision:
+class Revision(object):
+    """A changeset, dated by its push as seconds since the epoch."""
+    __slots__ = ('node_id', 'date')
     def __init__(self, node_id):
         self.node_id = node_id
     def __eq__(self, other):
-        for i in range(9):
-            if self.date[i] != other.date[i]:
-                return False
-        return True
+        return self.date == other.date
     def __ne__(self, other):
-        for i in range(9):
-            if self.date[i] != other.date[i]:
-                return True
-        return False
+        return self.date != other.date
     def __lt__(self, other):
         return self.date < other.date
     def __gt__(self, other):
-        return other.date < self.date
+        return self.date > other.date
     def __le__(self, other):
-        return not other.date < self.date
+        return self.date <= other.date
     def __ge__(self, other):
-        return not self.date < other.date
+        return self.date >= other.date
     def same_node(self, other):
         return self.node_id == other.node_id
     def __str__(self):
         return self.node_id
 
-class ChangeInformation:
+class ChangeInformation(object):
+    __slots__ = ('fromchange', 'tochange', 'deltas')
     def __init__(self, deltas, fromchange, tochange):
         if type(fromchange) == str or type(fromchange) == unicode:
             self.fromchange = Revision(fromchange)
@@ -68,20 +137,27 @@ class ChangeInformation:
             self.tochange = Revision(tochange)
         else:
             self.tochange = tochange
+        # A frozenset of TalosDeltas, shared between ranges where possible.
         self.deltas = deltas
     def __str__(self):
-        fromdate = time.strftime("%Y-%m-%d %H:%M:%S", self.fromchange.date)
-        todate = time.strftime("%Y-%m-%d %H:%M:%S", self.tochange.date)
+        fromdate = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.fromchange.date))
+        todate = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.tochange.date))
         s = "%s (%s):%s (%s)" % (self.fromchange.node_id, fromdate, self.tochange.node_id, todate)
         for x in self.deltas:
             s += " " + str(x)
         return s
 
-class TalosDelta:
-    def __init__(self, sign, amount, platform):
+class TalosDelta(object):
+    """The change to a test's result on one platform.  Whether a change is
+    a regression depends on whether the test is better higher or lower, so
+    it is taken from the mail rather than from SIGN; REGRESSION is None
+    where it isn't known."""
+    __slots__ = ('sign', 'amount', 'platform', 'regression')
+    def __init__(self, sign, amount, platform, regression=None):
         self.sign = sign
         self.amount = amount
         self.platform = platform
+        self.regression = regression
     def __eq__(self, other):
         return other is not None and self.platform == other.platform
     def __ne__(self, other):
@@ -92,84 +168,1108 @@ class TalosDelta:
         return "%s: %s%s" % (self.platform, self.sign, self.amount)
     def for_platform(self, p):
         return self.platform == p
+    def percentage(self):
+        if self.sign == '-':
+            return -self.amount
+        return self.amount
 
 subject_trans_table = string.maketrans("\t", " ")
 
-def subject_of(msg):
+def normalize_subject(subject):
     global subject_trans_table
-    subject = msg.get('Subject')
     if subject is None:
         return subject
     return subject.translate(subject_trans_table, "\n")
 
+def subject_of(msg):
+    return normalize_subject(msg.get('Subject'))
+
+def message_timestamp(date):
+    if date is None:
+        return None
+    parsed = rfc822.parsedate(date)
+    if parsed is None:
+        return None
+    return time.mktime(parsed)
+
+class Stats:
+    """Counters and wall times for the stages of a run, reported with
+    --profile.  Updates may come from several threads."""
+    def __init__(self):
+        self.counters = {}
+        self.times = {}
+        self.stages = []
+        self.lock = threading.Lock()
+    def __getstate__(self):
+        # Stats are sent back from the processes rendering tests.
+        return (self.counters, self.times, self.stages)
+    def __setstate__(self, state):
+        (self.counters, self.times, self.stages) = state
+        self.lock = threading.Lock()
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+    def add_time(self, stage, seconds):
+        with self.lock:
+            if stage not in self.times:
+                self.stages.append(stage)
+                self.times[stage] = 0.0
+            self.times[stage] += seconds
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+    def merge(self, other):
+        for stage in other.stages:
+            self.add_time(stage, other.times[stage])
+        for (name, n) in other.counters.iteritems():
+            self.count(name, n)
+    def summary(self):
+        lines = ['%-40s %10.3fs' % (stage, self.times[stage]) for stage in self.stages]
+        lines.extend(['%-40s %10d' % (name, self.counters[name])
+                      for name in sorted(self.counters.keys())])
+        return '\n'.join(lines)
+    def as_json(self):
+        return json.dumps({ 'stages': [{ 'stage': stage, 'seconds': self.times[stage] }
+                                       for stage in self.stages],
+                            'counters': self.counters },
+                          indent=2, sort_keys=True)
+
+stats = Stats()
+
+class PushlogFetcher:
+    """Fetch URLs over persistent HTTP connections, retrying requests that
+    fail or hit a server error with exponential backoff.  A fetcher is not
+    thread-safe; give every thread its own."""
+    redirect_statuses = (301, 302, 303, 307, 308)
+    max_redirects = 5
+    def __init__(self, retries=3, backoff=1.0, timeout=60):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.connections = {}
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key not in self.connections:
+            if scheme == 'https':
+                klass = httplib.HTTPSConnection
+            else:
+                klass = httplib.HTTPConnection
+            self.connections[key] = klass(netloc, timeout=self.timeout)
+        return self.connections[key]
+    def drop_connection(self, scheme, netloc):
+        conn = self.connections.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+    def request(self, url):
+        """Return the response to a GET of URL and its body, retrying on
+        connection and server errors."""
+        parts = urlparse.urlsplit(url)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+        attempt = 0
+        while True:
+            try:
+                conn = self.connection(parts.scheme, parts.netloc)
+                conn.request('GET', path)
+                response = conn.getresponse()
+                data = response.read()
+                if response.status < 500:
+                    return (response, data)
+                error = IOError("%s: HTTP %d %s" % (url, response.status, response.reason))
+            except (httplib.HTTPException, socket.error), e:
+                self.drop_connection(parts.scheme, parts.netloc)
+                error = e
+            if attempt == self.retries:
+                raise error
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+    def fetch(self, url):
+        """Return the body of URL, following up to max_redirects redirects,
+        each of which may be to another scheme or host."""
+        for redirects in range(self.max_redirects + 1):
+            (response, data) = self.request(url)
+            if response.status == 200:
+                return data
+            location = response.getheader('location')
+            if response.status not in self.redirect_statuses or location is None:
+                raise IOError("%s: HTTP %d %s" % (url, response.status, response.reason))
+            url = urlparse.urljoin(url, location)
+        raise IOError("%s: more than %d redirects" % (url, self.max_redirects))
+
+def push_boundaries_from_json(json_string):
+    """Return the dates of the first and last pushes in a json-pushes
+    response."""
+    return push_boundaries_of(json.loads(json_string))
+
+def push_boundaries_of(json_pushes):
+    # You might think the json information comes back in sorted revision order.
+    # You would be wrong.
+    json_items = json_pushes.items()
+    json_items.sort(key=lambda x: x[0])
+    first = json_items[0]
+    last = json_items[-1]
+    return (first[1]['date'], last[1]['date'])
+
+sqlite_header = 'SQLite format 3\0'
+
+class PendingFetch:
+    """A pushlog request in flight, which other threads wanting the same
+    range wait on instead of making the request again."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.boundaries = None
+        self.error = None
+
 class JSONCache:
-    def __init__(self, filename):
+    """A cache of json-pushes information, kept in an sqlite database so
+    that each range is written as soon as it is fetched and the cache can
+    be shared between runs.  Only the dates of the first and last pushes
+    of each range are kept, and ranges looked up once are remembered for
+    the rest of the run; the pushes themselves go into a table of their
+    own, from which later ranges can often be answered without asking
+    hg.mozilla.org at all.  A cache file in the old pickled format is
+    converted the first time it is opened.
+
+    Threads asking for a range that is already being fetched wait for that
+    request rather than making their own, and no more than PER_HOST
+    requests are made to any one host at once.
+
+    A tree whose whole pushlog has been imported with import_pushlog() is
+    answered from the push table alone; ranges it can't answer are only
+    fetched if FETCH_MISSING."""
+    def __init__(self, filename, per_host=8, timeout=60, fetch_missing=False):
+        self.filename = filename
+        self.timeout = timeout
+        self.fetch_missing = fetch_missing
+        self.mirrors = None
+        self.missing = set()
+        # Ranges prefetch() found weren't cached, so that push_boundaries()
+        # counts them as the misses they were.
+        self.fetched_ahead = set()
+        self.fetcher = self.new_fetcher()
+        self.db = None
+        self.lock = threading.Lock()
+        self.boundaries = {}
+        self.in_flight_lock = threading.Lock()
+        self.in_flight = {}
+        self.per_host = per_host
+        self.host_slots = {}
+    def new_fetcher(self):
+        return PushlogFetcher(timeout=self.timeout)
+    def connection(self):
+        if self.db is None:
+            self.migrate_pickle()
+            self.db = self.open_database(self.filename)
+        return self.db
+    def open_database(self, filename):
+        db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS boundaries "
+                   "(key TEXT PRIMARY KEY, from_date NUMERIC NOT NULL, "
+                   "to_date NUMERIC NOT NULL)")
+        # Every push seen in a pushlog response, so that ranges within the
+        # pushes already fetched can be answered without asking again.
+        db.execute("CREATE TABLE IF NOT EXISTS pushlog "
+                   "(tree TEXT NOT NULL, id INTEGER NOT NULL, date NUMERIC NOT NULL, "
+                   "PRIMARY KEY (tree, id))")
+        db.execute("CREATE TABLE IF NOT EXISTS pushlog_changesets "
+                   "(tree TEXT NOT NULL, node TEXT NOT NULL, id INTEGER NOT NULL, "
+                   "PRIMARY KEY (tree, node))")
+        # Days whose pushes have all been fetched.
+        db.execute("CREATE TABLE IF NOT EXISTS pushlog_days "
+                   "(tree TEXT NOT NULL, day TEXT NOT NULL, PRIMARY KEY (tree, day))")
+        # Trees whose whole pushlog has been imported.
+        db.execute("CREATE TABLE IF NOT EXISTS pushlog_mirrors (tree TEXT PRIMARY KEY)")
+        # Caches written before only the boundaries were kept held every
+        # push date of a range.
+        old = db.execute("SELECT name FROM sqlite_master "
+                         "WHERE type = 'table' AND name = 'pushes'").fetchone()
+        if old is not None:
+            rows = db.execute("SELECT key, dates FROM pushes").fetchall()
+            db.executemany("INSERT OR IGNORE INTO boundaries VALUES (?, ?, ?)",
+                           [(key, dates[0], dates[-1])
+                            for (key, dates) in [(k, json.loads(d)) for (k, d) in rows]])
+            db.execute("DROP TABLE pushes")
+        db.commit()
+        return db
+    def migrate_pickle(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                if f.read(len(sqlite_header)) == sqlite_header:
+                    return
+                f.seek(0)
+                cache = cPickle.Unpickler(f).load()
+        except IOError:
+            return
+        except:
+            # Not a pickle we understand either; start afresh.
+            cache = {}
+        temporary = self.filename + '.migrating'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        db = self.open_database(temporary)
+        db.executemany("INSERT OR REPLACE INTO boundaries VALUES (?, ?, ?)",
+                       [(key,) + push_boundaries_from_json(json_string)
+                        for (key, json_string) in cache.iteritems()])
+        db.commit()
+        db.close()
+        os.rename(temporary, self.filename)
+    def cached(self, key):
+        """Whether the range KEY is cached, without counting the lookup or
+        reading the range in."""
+        if key in self.boundaries:
+            return True
+        with self.lock:
+            row = self.connection().execute("SELECT 1 FROM boundaries WHERE key = ?",
+                                            (key,)).fetchone()
+        return row is not None
+    def lookup(self, key):
+        if key in self.boundaries:
+            stats.count('pushlog cache hits (memory)')
+            return self.boundaries[key]
+        with self.lock:
+            row = self.connection().execute("SELECT from_date, to_date FROM boundaries "
+                                            "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            stats.count('pushlog cache misses')
+            return None
+        stats.count('pushlog cache hits (disk)')
+        self.boundaries[key] = row
+        return row
+    def store(self, key, boundaries):
+        self.store_many([(key, boundaries)])
+    def store_many(self, items):
+        for (key, boundaries) in items:
+            self.boundaries[key] = boundaries
+        with self.lock:
+            db = self.connection()
+            db.executemany("INSERT OR REPLACE INTO boundaries VALUES (?, ?, ?)",
+                           [(key,) + tuple(boundaries) for (key, boundaries) in items])
+            db.commit()
+    def store_pushes(self, tree, json_pushes, day=None):
+        """Remember the pushes in the json-pushes response JSON_PUSHES, which
+        holds every push made on DAY if that is given."""
+        with self.lock:
+            db = self.connection()
+            db.executemany("INSERT OR REPLACE INTO pushlog VALUES (?, ?, ?)",
+                           [(tree.name, int(push_id), push['date'])
+                            for (push_id, push) in json_pushes.iteritems()])
+            db.executemany("INSERT OR REPLACE INTO pushlog_changesets VALUES (?, ?, ?)",
+                           [(tree.name, node, int(push_id))
+                            for (push_id, push) in json_pushes.iteritems()
+                            for node in push['changesets']])
+            # A day that may not be over yet wherever the server is could
+            # still gain pushes.
+            if day is not None and (datetime.date.today() - day).days > 1:
+                db.execute("INSERT OR REPLACE INTO pushlog_days VALUES (?, ?)",
+                           (tree.name, day.isoformat()))
+            db.commit()
+    def import_pushlog(self, tree, json_pushes):
+        """Store every push in JSON_PUSHES, a dump of TREE's whole pushlog in
+        the form json-pushes returns, and answer TREE's ranges from them
+        from now on.  Return the numbers of pushes and changesets stored."""
+        # Version 2 responses keep the pushes under a key of their own,
+        # and full ones describe each changeset rather than naming it.
+        if 'pushes' in json_pushes and 'lastpushid' in json_pushes:
+            json_pushes = json_pushes['pushes']
+        for push in json_pushes.itervalues():
+            push['changesets'] = [c['node'] if isinstance(c, dict) else c
+                                  for c in push['changesets']]
+        self.store_pushes(tree, json_pushes)
+        with self.lock:
+            db = self.connection()
+            db.execute("INSERT OR REPLACE INTO pushlog_mirrors VALUES (?)", (tree.name,))
+            db.commit()
+            self.mirrors = None
+        return (len(json_pushes),
+                sum([len(push['changesets']) for push in json_pushes.itervalues()]))
+    def may_fetch(self, tree):
+        """Whether ranges on TREE that can't be answered locally may be
+        fetched from hg.mozilla.org."""
+        if self.fetch_missing:
+            return True
+        with self.lock:
+            if self.mirrors is None:
+                self.mirrors = set([name for (name,) in
+                                    self.connection().execute("SELECT tree FROM pushlog_mirrors")])
+            return tree.name not in self.mirrors
+    def fetched_days(self, tree):
+        with self.lock:
+            rows = self.connection().execute("SELECT day FROM pushlog_days WHERE tree = ?",
+                                             (tree.name,)).fetchall()
+        return set([datetime.date(*map(int, day.split('-'))) for (day,) in rows])
+    def local_push_boundaries(self, tree, fromchange, tochange):
+        """Work out what push_boundaries() would return from the pushes
+        stored so far, or return None if they don't cover the range."""
+        with self.lock:
+            db = self.connection()
+            ids = []
+            for node in (fromchange, tochange):
+                # Changesets are named by prefixes of their hashes.
+                rows = db.execute("SELECT id FROM pushlog_changesets "
+                                  "WHERE tree = ? AND node >= ? AND node < ? LIMIT 2",
+                                  (tree.name, node, node + 'g')).fetchall()
+                if len(rows) != 1:
+                    return None
+                ids.append(rows[0][0])
+            (first, last) = ids
+            if first >= last:
+                return None
+            # json-pushes leaves out the push FROMCHANGE is in.
+            rows = db.execute("SELECT id, date FROM pushlog "
+                              "WHERE tree = ? AND id > ? AND id <= ?",
+                              (tree.name, first, last)).fetchall()
+        # Push ids are consecutive, so any missing push is noticed here.
+        if len(rows) != last - first:
+            return None
+        stats.count('pushlog ranges answered locally')
+        return push_boundaries_of(dict([(str(push_id), { 'date': date })
+                                        for (push_id, date) in rows]))
+    def host_slot(self, url):
+        netloc = urlparse.urlsplit(url).netloc
+        with self.in_flight_lock:
+            if netloc not in self.host_slots:
+                self.host_slots[netloc] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[netloc]
+    def fetch(self, fetcher, tree, fromchange, tochange):
+        key = tree.cache_key(fromchange, tochange)
+        with self.in_flight_lock:
+            if key in self.boundaries:
+                return self.boundaries[key]
+            pending = self.in_flight.get(key)
+            waiting = pending is not None
+            if not waiting:
+                pending = self.in_flight[key] = PendingFetch()
+        if waiting:
+            stats.count('pushlog fetches coalesced')
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.boundaries
+
+        try:
+            url = tree.json_pushes_url % (fromchange, tochange)
+            stats.count('pushlog fetches')
+            with self.host_slot(url):
+                with stats.stage('pushlog fetch latency (all threads)'):
+                    json_string = fetcher.fetch(url)
+            json_pushes = json.loads(json_string)
+            pending.boundaries = push_boundaries_of(json_pushes)
+            self.store_pushes(tree, json_pushes)
+            self.store(key, pending.boundaries)
+        except Exception, e:
+            pending.error = e
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+            pending.done.set()
+        return pending.boundaries
+    def fetch_day(self, fetcher, tree, day):
+        url = tree.json_pushes_by_date_url % (day.isoformat(),
+                                              (day + datetime.timedelta(days=1)).isoformat())
+        stats.count('pushlog day fetches')
+        with self.host_slot(url):
+            with stats.stage('pushlog fetch latency (all threads)'):
+                json_string = fetcher.fetch(url)
+        self.store_pushes(tree, json.loads(json_string), day)
+    def push_boundaries(self, tree, fromchange, tochange):
+        """Return the dates of the first and last pushes in the range from
+        FROMCHANGE to TOCHANGE on TREE, or None if they aren't known
+        locally and may not be fetched."""
+        key = tree.cache_key(fromchange, tochange)
+        if key in self.fetched_ahead:
+            self.fetched_ahead.discard(key)
+            stats.count('pushlog cache misses')
+            boundaries = self.boundaries.get(key)
+        else:
+            boundaries = self.lookup(key)
+        if boundaries is not None:
+            return boundaries
+        boundaries = self.local_push_boundaries(tree, fromchange, tochange)
+        if boundaries is not None:
+            self.store(key, boundaries)
+            return boundaries
+        if not self.may_fetch(tree):
+            stats.count('pushlog ranges missing from a mirror')
+            self.missing.add((tree.name, fromchange, tochange))
+            return None
+        return self.fetch(self.fetcher, tree, fromchange, tochange)
+    def answer_locally(self, wanted):
+        """Store whichever of the ranges in WANTED, a dictionary of cache
+        keys to (tree, fromchange, tochange), can be answered from the
+        pushes stored so far, and return the rest."""
+        found = []
+        unanswered = {}
+        for (key, r) in wanted.iteritems():
+            boundaries = self.local_push_boundaries(*r)
+            if boundaries is None:
+                unanswered[key] = r
+            else:
+                found.append((key, boundaries))
+        if len(found) != 0:
+            self.store_many(found)
+        return unanswered
+
+    # The pushes in a range are looked for this many days before and after
+    # the day of the message it came from.
+    days_before_message = 2
+    days_after_message = 1
+
+    def plan_day_fetches(self, wanted, message_days):
+        """Return the (tree, day) pairs worth fetching whole for the ranges
+        in WANTED.  The days around each range's messages, listed in
+        MESSAGE_DAYS by cache key, are gathered into runs of consecutive
+        days; a run is fetched if it holds more ranges than it has days
+        not yet fetched, since otherwise asking for each range on its own
+        is cheaper."""
+        by_tree = {}
+        for (key, (tree, fromchange, tochange)) in wanted.iteritems():
+            if not self.may_fetch(tree):
+                continue
+            for day in message_days.get(key, ()):
+                by_tree.setdefault(tree.name, (tree, []))[1].append((day, key))
+        planned = []
+        for (tree, key_days) in by_tree.itervalues():
+            fetched = self.fetched_days(tree)
+            windows = sorted([(day - datetime.timedelta(days=self.days_before_message),
+                               day + datetime.timedelta(days=self.days_after_message),
+                               key)
+                              for (day, key) in key_days])
+            clusters = []
+            for (first, last, key) in windows:
+                if len(clusters) != 0 and first <= clusters[-1][1] + datetime.timedelta(days=1):
+                    cluster = clusters[-1]
+                    cluster[1] = max(cluster[1], last)
+                    cluster[2].add(key)
+                else:
+                    clusters.append([first, last, set([key])])
+            for (first, last, keys) in clusters:
+                days = [first + datetime.timedelta(days=i)
+                        for i in range((last - first).days + 1)]
+                days = [day for day in days if day not in fetched]
+                if len(keys) > len(days):
+                    planned.extend([(tree, day) for day in days])
+        return planned
+    def run_fetches(self, tasks, jobs):
+        """Call each (function, arguments) in TASKS with a fetcher of its
+        own thread and the arguments, using up to JOBS threads.  Failed
+        requests are dropped."""
+        pending = Queue.Queue()
+        for task in tasks:
+            pending.put(task)
+
+        def worker():
+            fetcher = self.new_fetcher()
+            while True:
+                try:
+                    (function, arguments) = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    function(fetcher, *arguments)
+                except (IOError, httplib.HTTPException, socket.error):
+                    pass
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(jobs, len(tasks)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    def prefetch(self, ranges, jobs):
+        """Fetch every (tree, fromchange, tochange, when) range in RANGES that
+        isn't cached yet, using up to JOBS threads.  WHEN is the date of the
+        message the range came from, or None.
+
+        Where many ranges come from messages close together, the pushes of
+        the days around them are fetched a day at a time instead and the
+        ranges answered from those; the rest are asked for one by one.
+        Ranges that can't be fetched are left for push_boundaries() to
+        retry, and report, on its own."""
+        wanted = {}
+        message_days = {}
+        for (tree, fromchange, tochange, when) in ranges:
+            key = tree.cache_key(fromchange, tochange)
+            if key not in wanted:
+                if self.cached(key):
+                    continue
+                wanted[key] = (tree, fromchange, tochange)
+            if when is not None:
+                message_days.setdefault(key, set()).add(when.date())
+        if len(wanted) == 0:
+            return
+
+        self.fetched_ahead.update(wanted.keys())
+        wanted = self.answer_locally(wanted)
+        days = self.plan_day_fetches(wanted, message_days)
+        if len(days) != 0:
+            self.run_fetches([(self.fetch_day, day) for day in days], jobs)
+            wanted = self.answer_locally(wanted)
+        self.run_fetches([(self.fetch, r) for r in wanted.itervalues() if self.may_fetch(r[0])],
+                         jobs)
+    def save(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def headers_match_p(to, subject, timestamp, begin_date, end_date, subject_regex):
+    """Cheap version of message_matches_p for headers pulled out of the
+    mbox without parsing the whole message."""
+    if to is None or not to.startswith(list_address_prefix):
+        stats.count('rejected: not to the list')
+        return False
+    subject = normalize_subject(subject)
+    if subject is None:
+        stats.count('rejected: no subject')
+        return False
+    stats.count('subject regex attempts')
+    if subject_regex.search(subject) is None:
+        stats.count('rejected: subject')
+        return False
+    if timestamp is not None:
+        msg_date = datetime.datetime.fromtimestamp(timestamp)
+        if not ((begin_date < msg_date) and (msg_date < end_date)):
+            stats.count('rejected: date')
+            return False
+    return True
+
+class ScannedMessage(mailbox.mboxMessage):
+    """A message whose headers headers_match_p has already passed."""
+    subject_matched = True
+
+def mbox_message_from_string(string):
+    from_line, string = string.split('\n', 1)
+    msg = ScannedMessage(string)
+    msg.set_from(from_line[5:])
+    return msg
+
+interesting_header_re = re.compile(r"^(to|subject|date):[ \t]*(.*(?:\n[ \t].*)*)",
+                                   re.IGNORECASE | re.MULTILINE)
+
+def interesting_headers(header_block):
+    """Return the first To, Subject and Date headers in HEADER_BLOCK as the
+    email package would, without building a Message."""
+    headers = {}
+    for match in interesting_header_re.finditer(header_block):
+        name = match.group(1).lower()
+        if name not in headers:
+            headers[name] = match.group(2).rstrip('\r\n')
+    return headers
+
+def scan_mbox_buffer(buf, start, size, at_end, begin_date, end_date,
+                     subject_regex):
+    """Look at the raw headers of each message in BUF from START, which must
+    be the start of a message, up to SIZE, and yield the text of those
+    that might match.  Message boundaries are found the same way
+    mailbox.mbox finds them.  Unless AT_END, the last message may be cut
+    short, so it is left alone; unscanned_start says where it starts."""
+    # Counted locally; the scan is the hottest loop there is.
+    n_scanned = 0
+    n_not_to_list = 0
+    try:
+        while start < size:
+            separator = buf.find('\nFrom ', start, size)
+            if separator == -1:
+                if not at_end:
+                    break
+                next_start = size
+                last_was_empty = buf[size-2:size] == '\n\n'
+                stop = size - 1 if last_was_empty else size
+            else:
+                next_start = separator + 1
+                last_was_empty = buf[separator-1] == '\n'
+                stop = separator if last_was_empty else next_start
+
+            line_end = buf.find('\n', start, stop)
+            if line_end != -1:
+                header_end = buf.find('\n\n', line_end, stop)
+                if header_end == -1:
+                    header_end = stop
+                else:
+                    header_end += 1
+                headers = interesting_headers(buf[line_end+1:header_end])
+                to = headers.get('to')
+                n_scanned += 1
+                if to is None or not to.startswith(list_address_prefix):
+                    n_not_to_list += 1
+                elif headers_match_p(to, headers.get('subject'),
+                                     message_timestamp(headers.get('date')),
+                                     begin_date, end_date, subject_regex):
+                    yield buf[start:stop]
+            start = next_start
+    finally:
+        stats.count('messages scanned', n_scanned)
+        stats.count('rejected: not to the list', n_not_to_list)
+
+def unscanned_start(buf, start, size):
+    """Where the message that scan_mbox_buffer left alone, not being at the
+    end, starts."""
+    return max(start, buf.rfind('\nFrom ', start, size) + 1)
+
+def scan_mbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                    start=0, stop=None):
+    """Walk the mbox through mmap and yield the text of the messages that
+    might match.  Only the part of the mbox from START, which must be the
+    start of a message, up to STOP is looked at."""
+    with open(mbox_file, 'rb') as f:
+        if stop is None:
+            stop = os.fstat(f.fileno()).st_size
+        if stop == 0 or start >= stop:
+            return
+        mm = mmap.mmap(f.fileno(), stop, access=mmap.ACCESS_READ)
+        try:
+            if mm[start:start+5] != 'From ':
+                start = mm.find('\nFrom ', start) + 1
+                if start == 0:
+                    return
+            for text in scan_mbox_buffer(mm, start, len(mm), True, begin_date,
+                                         end_date, subject_regex):
+                yield text
+        finally:
+            mm.close()
+
+def scan_mbox_messages(mbox_file, begin_date, end_date, subject_regex,
+                       start=0, stop=None):
+    """Walk the mbox through mmap, looking only at the raw headers of each
+    message, and yield a parsed message for those that might match.  Only
+    the part of the mbox from START, which must be the start of a message,
+    up to STOP is looked at."""
+    for text in scan_mbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                                start, stop):
+        yield mbox_message_from_string(text)
+
+def mbox_complete_end(mbox_file, start, size, settled=True):
+    """Return where the messages in the mbox from START, which must be the
+    start of a message, up to SIZE that have been wholly written end.
+    Unless SETTLED and the mbox ends with a blank line, its last message is
+    taken to be still being delivered, and is left out."""
+    if size <= start:
+        return start
+    with open(mbox_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            if settled and mm[size-2:size] == '\n\n':
+                return size
+            separator = mm.rfind('\nFrom ', start, size)
+        finally:
+            mm.close()
+    if separator == -1:
+        return start
+    return separator + 1
+
+def open_xz(filename):
+    if lzma is None:
+        raise IOError("%s: reading xz files needs the lzma module" % filename)
+    return lzma.LZMAFile(filename, 'rb')
+
+mailbox_decompressors = { '.gz': lambda filename: gzip.GzipFile(filename, 'rb'),
+                          '.bz2': lambda filename: bz2.BZ2File(filename, 'rb'),
+                          '.xz': open_xz }
+
+def mailbox_decompressor(mbox_file):
+    return mailbox_decompressors.get(os.path.splitext(mbox_file)[1])
+
+# How much of a compressed mailbox to decompress at a time.
+decompress_chunk_size = 1 << 24
+
+def scan_compressed_mbox_texts(mbox_file, begin_date, end_date, subject_regex):
+    """Yield the text of the messages that might match in a compressed mbox,
+    which is decompressed a piece at a time as it is scanned."""
+    f = mailbox_decompressor(mbox_file)(mbox_file)
+    try:
+        buf = ''
+        start = None
+        at_end = False
+        while not at_end:
+            chunk = f.read(decompress_chunk_size)
+            at_end = len(chunk) == 0
+            buf += chunk
+            if start is None:
+                # Skip anything before the first message.
+                if buf.startswith('From '):
+                    start = 0
+                else:
+                    separator = buf.find('\nFrom ')
+                    if separator == -1:
+                        buf = buf[-5:]
+                        continue
+                    start = separator + 1
+            for text in scan_mbox_buffer(buf, start, len(buf), at_end, begin_date,
+                                         end_date, subject_regex):
+                yield text
+            if not at_end:
+                buf = buf[unscanned_start(buf, start, len(buf)):]
+            start = 0
+    finally:
+        f.close()
+
+def mailbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                  start=0, stop=None):
+    if mailbox_decompressor(mbox_file) is not None:
+        return scan_compressed_mbox_texts(mbox_file, begin_date, end_date, subject_regex)
+    return scan_mbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                           start, stop)
+
+def mbox_pieces(mbox_file, n_pieces, start=0, stop=None):
+    """Split the part of an uncompressed mbox from START, which must be the
+    start of a message, up to STOP into at most N_PIECES pieces of about the
+    same size, and return (mbox_file, start, stop) for each in order.  Each
+    piece but the first starts on a "From " separator line, found the same
+    way scan_mbox_buffer finds them, so no message is split between two."""
+    if n_pieces <= 1:
+        return [(mbox_file, start, stop)]
+    with open(mbox_file, 'rb') as f:
+        if stop is None:
+            stop = os.fstat(f.fileno()).st_size
+        if stop - start < n_pieces:
+            return [(mbox_file, start, stop)]
+        mm = mmap.mmap(f.fileno(), stop, access=mmap.ACCESS_READ)
+        try:
+            bounds = [start]
+            for i in range(1, n_pieces):
+                offset = start + (stop - start) * i // n_pieces
+                separator = mm.find('\nFrom ', max(offset - 1, bounds[-1]))
+                if separator == -1:
+                    break
+                bounds.append(separator + 1)
+        finally:
+            mm.close()
+    bounds.append(stop)
+    return [(mbox_file, piece_start, piece_stop)
+            for (piece_start, piece_stop) in zip(bounds, bounds[1:])]
+
+def mailbox_pieces(mbox_files, n_pieces):
+    """Split MBOX_FILES into about N_PIECES pieces in all, returning
+    (mbox_file, start, stop) for each in order.  A compressed mailbox can't
+    be split, so it is always a single piece."""
+    pieces = []
+    for mbox_file in mbox_files:
+        if mailbox_decompressor(mbox_file) is not None:
+            pieces.append((mbox_file, 0, None))
+        else:
+            pieces.extend(mbox_pieces(mbox_file, max(1, n_pieces // len(mbox_files))))
+    return pieces
+
+def scan_mailboxes(pieces, begin_date, end_date, subject_regex):
+    """Yield the messages that might match in each of PIECES, as made by
+    mailbox_pieces, in turn."""
+    for (mbox_file, start, stop) in pieces:
+        for text in mailbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                                  start, stop):
+            yield mbox_message_from_string(text)
+
+def scan_mailbox_piece(args):
+    """Return the records, made by extract_record, of the Talos messages in
+    one piece of a mailbox, and the Stats for the scan.  ARGS are the
+    mailbox, start and stop of the piece followed by the criteria of the
+    MessageDispatcher.  This runs in a worker process."""
+    global stats
+    stats = Stats()
+    (mbox_file, start, stop, criteria) = args
+    (begin_date, end_date, subject_regex) = criteria[:3]
+    records = []
+    for text in mailbox_texts(mbox_file, begin_date, end_date, subject_regex,
+                              start, stop):
+        record = extract_record(mbox_message_from_string(text), *criteria)
+        if record is not None:
+            records.append(record)
+    return (records, stats)
+
+def scan_mailbox_records(pieces, criteria, jobs):
+    """Yield the records of the Talos messages in each of PIECES, scanning
+    and parsing them on up to JOBS processes at once.  The records come
+    back in the order of the pieces, and so in the order one process would
+    have found the messages in."""
+    pool = multiprocessing.Pool(min(jobs, len(pieces)))
+    try:
+        for (records, worker_stats) in pool.imap(scan_mailbox_piece,
+                                                 [piece + (criteria,) for piece in pieces]):
+            stats.merge(worker_stats)
+            for record in records:
+                yield record
+    finally:
+        pool.close()
+        pool.join()
+
+def mailbox_files(patterns):
+    """Return the mailboxes named by PATTERNS, each of which may be a glob,
+    in the order given; the files matching one glob are sorted by name."""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            # Let opening it report that it doesn't exist.
+            matches = [pattern]
+        files.extend(matches)
+    return files
+
+def index_entry(start, stop, header_lines):
+    headers = email.parser.HeaderParser().parsestr(''.join(header_lines))
+    return (start, stop - start, message_timestamp(headers.get('Date')),
+            headers.get('To'), headers.get('Subject'))
+
+def index_mbox_messages(f, start):
+    """Return an index entry for every message in the mbox F from offset
+    START onwards.  Message boundaries are found the same way
+    mailbox.mbox finds them."""
+    entries = []
+    f.seek(start)
+    msg_start = None
+    header_lines = None
+    in_headers = False
+    last_was_empty = False
+    while True:
+        line_pos = f.tell()
+        line = f.readline()
+        if line.startswith('From ') or not line:
+            if msg_start is not None:
+                stop = line_pos - 1 if last_was_empty else line_pos
+                entries.append(index_entry(msg_start, stop, header_lines))
+            if not line:
+                break
+            msg_start = line_pos
+            header_lines = []
+            in_headers = True
+            last_was_empty = False
+            continue
+        last_was_empty = line == '\n'
+        if in_headers:
+            if last_was_empty:
+                in_headers = False
+            else:
+                header_lines.append(line)
+    return entries
+
+class MboxIndex:
+    """A sidecar index of an mbox, recording for every message its byte
+    offset and length along with the To, Subject and Date headers that
+    message_matches_p looks at.  Only messages that pass those checks are
+    ever read from the mbox itself."""
+    version = 2
+    # How much of the mbox before the last message indexed to keep, to
+    # notice the mbox being rewritten rather than appended to.
+    tail_length = 256
+    def __init__(self, mbox_file, filename):
+        self.mbox_file = mbox_file
         self.filename = filename
         try:
-            with open(filename, 'r') as f:
+            with open(filename, 'rb') as f:
                 p = cPickle.Unpickler(f)
-                self.cache = p.load()
+                index = p.load()
+            assert index['version'] == self.version
+            self.entries = index['entries']
+            self.tail = index['tail']
         except:
-            self.cache = {}
-    def json(self, fromchange, tochange):
-        key = fromchange + tochange
-        if key in self.cache:
-            return self.cache[key]
-
-        m_i_url = m_i_json_pushes_url % (fromchange, tochange)
-        json_stream = urllib2.urlopen(m_i_url)
-        json_string = json_stream.read()
-        self.cache[key] = json_string
-        return json_string
+            self.entries = []
+            self.tail = ''
+        self.update()
+    def mbox_tail(self, f, offset):
+        start = max(0, offset - self.tail_length)
+        f.seek(start)
+        return f.read(offset - start)
+    def update(self):
+        # The last message we know about may have been only partially
+        # written when we indexed it, so always rescan from its start.
+        with open(self.mbox_file, 'rb') as f:
+            start = 0
+            if len(self.entries) != 0:
+                last = self.entries.pop()
+                if self.mbox_tail(f, last[0]) == self.tail and f.read(5) == 'From ':
+                    start = last[0]
+                else:
+                    # The mbox was truncated or rewritten; start over.
+                    self.entries = []
+            self.entries.extend(index_mbox_messages(f, start))
+            self.tail = ''
+            if len(self.entries) != 0:
+                self.tail = self.mbox_tail(f, self.entries[-1][0])
+    def messages(self, begin_date, end_date, subject_regex, start=0, stop=None):
+        with open(self.mbox_file, 'rb') as f:
+            for (offset, length, timestamp, to, subject) in self.entries:
+                if offset < start or (stop is not None and offset >= stop):
+                    continue
+                stats.count('messages scanned')
+                if not headers_match_p(to, subject, timestamp,
+                                       begin_date, end_date, subject_regex):
+                    continue
+                f.seek(offset)
+                yield mbox_message_from_string(f.read(length))
     def save(self):
-        with open(self.filename, 'w') as f:
-            p = cPickle.Pickler(f)
-            p.dump(self.cache)
+        with open(self.filename, 'wb') as f:
+            p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+            p.dump({ 'version': self.version, 'entries': self.entries,
+                     'tail': self.tail })
+
+class ReportState:
+    """The change lists of every test as of some point in an mbox, saved
+    between runs over the same mbox, trees and date ranges so that a run
+    only has to look at the messages appended since the last one."""
+    version = 6
+    # How much of the mbox before the saved offset to keep, to notice the
+    # mbox being rewritten rather than appended to.
+    tail_length = 256
+    def __init__(self, filename, mbox_file, trees, date_ranges):
+        self.filename = filename
+        self.mbox_file = mbox_file
+        self.tree_names = sorted([t.name for t in trees])
+        self.date_ranges = date_ranges
+        try:
+            with open(filename, 'rb') as f:
+                p = cPickle.Unpickler(f)
+                state = p.load()
+            assert state['version'] == self.version
+            assert state['mbox_file'] == mbox_file
+            assert state['trees'] == self.tree_names
+            assert state['date_ranges'] == date_ranges
+            assert state['tail'] == self.mbox_tail(state['offset'])
+            self.offset = state['offset']
+            self.tests = state['tests']
+        except:
+            self.offset = 0
+            self.tests = {}
+    def mbox_tail(self, offset):
+        with open(self.mbox_file, 'rb') as f:
+            start = max(0, offset - self.tail_length)
+            f.seek(start)
+            return f.read(offset - start)
+    def restore(self, tests):
+        for t in tests:
+            if t.key() in self.tests:
+                (t.changes, t.n_emails) = self.tests[t.key()]
+    def save(self, tests, offset):
+        """Save the state of TESTS, which account for the mbox up to OFFSET.
+        This must happen before the tests are rendered, which rearranges
+        their changes."""
+        for t in tests:
+            t.insert_pending()
+        self.offset = offset
+        self.tests = dict([(t.key(), (t.changes, t.n_emails)) for t in tests])
+        with open(self.filename, 'wb') as f:
+            p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+            p.dump({ 'version': self.version,
+                     'mbox_file': self.mbox_file,
+                     'trees': self.tree_names,
+                     'date_ranges': self.date_ranges,
+                     'offset': offset,
+                     'tail': self.mbox_tail(offset),
+                     'tests': self.tests })
+
+class MboxFollower:
+    """Hand out the messages appended to an mbox since the last time."""
+    def __init__(self, mbox_file):
+        self.mbox_file = mbox_file
+        self.offset = 0
+        self.tail = ''
+        self.last_size = None
+    def read(self, start, stop):
+        with open(self.mbox_file, 'rb') as f:
+            f.seek(start)
+            return f.read(stop - start)
+    def new_messages(self, begin_date, end_date, subject_regex):
+        """Return the messages appended since the last call that might
+        match, or None if the mbox has been rewritten rather than
+        appended to."""
+        size = os.path.getsize(self.mbox_file)
+        if size < self.offset or self.read(self.offset - len(self.tail), self.offset) != self.tail:
+            return None
+        # The last message may still be being delivered; leave it until the
+        # mbox stops growing and ends with a blank line.
+        stop = mbox_complete_end(self.mbox_file, self.offset, size,
+                                 size == self.last_size)
+        self.last_size = size
+        if stop <= self.offset:
+            return []
+        texts = scan_mbox_texts(self.mbox_file, begin_date, end_date,
+                                subject_regex, self.offset, stop)
+        self.offset = stop
+        self.tail = self.read(max(0, stop - ReportState.tail_length), stop)
+        return [mbox_message_from_string(text) for text in texts]
+
+class MaildirFollower:
+    """Hand out the messages delivered to a Maildir since the last time.
+    Messages removed from the Maildir aren't noticed."""
+    def __init__(self, path):
+        self.maildir = mailbox.Maildir(path, factory=None, create=False)
+        self.seen = set()
+    def new_messages(self, begin_date, end_date, subject_regex):
+        keys = [key for key in self.maildir.iterkeys() if key not in self.seen]
+        # Keys start with the time of delivery.
+        keys.sort()
+        self.seen.update(keys)
+        return [self.maildir.get_message(key) for key in keys]
+
+def mailbox_follower(path):
+    if os.path.isdir(path):
+        return MaildirFollower(path)
+    return MboxFollower(path)
+
+def changeset_range(msg, tree=default_tree):
+    assert not msg.is_multipart()
+    match = tree.changeset_range_re.search(msg.get_payload())
+    assert match is not None
+    return (match.group(1), match.group(2))
 
-def grovel_message_information(msg, platform):
+def message_change(msg, tree=default_tree):
+    """Return the sign and amount of the change MSG reports, whether it is a
+    regression, and the changesets it happened between."""
     subject = subject_of(msg)
     assert subject is not None
     match = subject_percent_change_re.search(subject)
     if match is None:
         print >>sys.stdout, subject, 'did not match!'
         assert match is not None
-    sign = { 'de': '-', 'in': '+' }[match.group(1)]
-    amount = float(match.group(2))
+    regression = match.group(1) == 'Regression'
+    sign = { 'de': '-', 'in': '+' }[match.group(2)]
+    amount = float(match.group(3))
 
-    date = msg.get('Date')
-    parsed = rfc822.parsedate(date)
-
-    assert not msg.is_multipart()
-    body = msg.get_payload()
-
-    match = changeset_range_re.search(body)
-    assert match is not None
-    fromchange = match.group(1)
-    tochange = match.group(2)
+    (fromchange, tochange) = changeset_range(msg, tree)
+    return (sign, amount, regression, fromchange, tochange)
 
+def change_information(platform, sign, amount, regression, fromchange, tochange,
+                       tree=default_tree):
     if fromchange == tochange:
         # Bizarre.  Skip this.
         return None
 
-    deltas = set()
-    deltas.add(TalosDelta(sign, amount, platform))
+    deltas = frozenset([TalosDelta(sign, amount, platform, regression)])
 
     ci = ChangeInformation(deltas, fromchange, tochange)
 
-    json_string = json_cache.json(fromchange, tochange)
-    json_pushes = json.loads(json_string)
+    boundaries = json_cache.push_boundaries(tree, fromchange, tochange)
+    if boundaries is None:
+        # Not in an imported pushlog, and fetching wasn't asked for.
+        return None
 
-    # You might think the json information comes back in sorted revision order.
-    # You would be wrong.
-    json_items = json_pushes.items()
-    json_items.sort(key=lambda x: x[0])
-    first = json_items[0]
-    last = json_items[-1]
-    ci.fromchange.date = time.gmtime(first[1]['date'])
-    ci.tochange.date = time.gmtime(last[1]['date'])
+    # Dates are only ever compared to the second.
+    (from_date, to_date) = boundaries
+    ci.fromchange.date = int(from_date)
+    ci.tochange.date = int(to_date)
 
     return ci
 
+def grovel_message_information(msg, platform, tree=default_tree):
+    (sign, amount, regression, fromchange, tochange) = message_change(msg, tree)
+    return change_information(platform, sign, amount, regression, fromchange, tochange, tree)
+
+def parse_date_ranges(desc, window_days=[]):
+    """Return the date ranges described by DESC, a comma-separated list of
+    date ranges, followed by a range covering the last N days of the first
+    of them for every N in WINDOW_DAYS."""
+    date_ranges = desc.split(',')
+    if len(window_days) != 0:
+        (start_date, end_date) = parse_date_range(date_ranges[0])
+        last_day = end_date - datetime.date.resolution
+        for days in window_days:
+            window_start = end_date - datetime.timedelta(days=days)
+            date_ranges.append('%s-%s' % (window_start.strftime('%d/%m/%Y'),
+                                          last_day.strftime('%d/%m/%Y')))
+    return date_ranges
+
 def parse_date_range(mutt_date_desc):
     date_re = r"(\d{2})/(\d{2})/(\d{4})"
     m = re.match(date_re + "-" + date_re, mutt_date_desc)
@@ -180,47 +1280,72 @@ def parse_date_range(mutt_date_desc):
     end_date = datetime.datetime(int(m.group(6)), int(m.group(5)), int(m.group(4))) + datetime.date.resolution
     return (start_date, end_date)
 
+def message_datetime(msg):
+    # This is a little silly.
+    return datetime.datetime.fromtimestamp(time.mktime(rfc822.parsedate(msg.get('Date'))))
+
 def message_matches_p(msg, begin_date, end_date, subject_regex):
     to = msg.get('To')
     if to is None:
+        stats.count('rejected: not to the list')
         return None
 
-    if not to.startswith('dev-tree-management@'):
+    if not to.startswith(list_address_prefix):
+        stats.count('rejected: not to the list')
         return None
 
     subject = subject_of(msg)
     if subject is None:
+        stats.count('rejected: no subject')
         return None
 
+    # The subject of a message the scan found has been tried already, and
+    # is only matched again for its groups.
+    if not getattr(msg, 'subject_matched', False):
+        stats.count('subject regex attempts')
     match = subject_regex.search(subject)
-    if match is not None:
-        matched_platform = match.group(1)
-        non_pgo = match.group(2)
+    if match is None:
+        stats.count('rejected: subject')
+    else:
+        matched_platform = match.group('platform')
+        non_pgo = match.group('non_pgo')
         if non_pgo is None:
             matched_platform += "-PGO"
-        # This is a little silly.
-        msg_date = datetime.datetime.fromtimestamp(time.mktime(rfc822.parsedate(msg.get('Date'))))
+        msg_date = message_datetime(msg)
         if (begin_date < msg_date) and (msg_date < end_date):
-            return msg, matched_platform
+            return msg, matched_platform, match
+        stats.count('rejected: date')
+
+def extract_record(msg, begin_date, end_date, subject_regex, windows, trees):
+    """Return a record of what MSG reports if it is a Talos message for one
+    of the tests that WINDOWS gives the date ranges of, by the subject name
+    of their tree in TREES and their name, or None.  A record is the tuple
+
+      (tree subject name, test, platform, date, sign, amount, regression,
+       fromchange, tochange)
+
+    which is all that is kept of the message, and is small enough to send
+    back from a worker process cheaply."""
+    match = message_matches_p(msg, begin_date, end_date, subject_regex)
+    if match is None:
+        return None
+
+    msg, platform, subject_match = match
+    key = (subject_match.group('tree'), subject_match.group('test'))
+    msg_date = message_datetime(msg)
+    for (begin, end) in windows.get(key, []):
+        if begin < msg_date and msg_date < end:
+            break
+    else:
+        return None
+    return key + (platform, msg_date) + message_change(msg, trees[key[0]])
 
 def merge_deltas(x, y):
-    deltas = set()
-    intersection = x.deltas & y.deltas
-    if None and len(intersection) != 0:
-        print x.fromchange
-        print x.tochange
-        print 'x entries:'
-        for i in x.deltas:
-            print i
-        print y.fromchange
-        print y.tochange
-        print 'y entries:'
-        for i in y.deltas:
-            print i
-        raise BaseException, "OUCH"
-    deltas.update(x.deltas)
-    deltas.update(y.deltas)
-    return deltas
+    # Where one range's deltas already cover the other's platforms, share
+    # its set rather than building a new one.  The deltas of X win.
+    if x.deltas is y.deltas or y.deltas <= x.deltas:
+        return x.deltas
+    return x.deltas | y.deltas
 
 #    |---SMALLER---|
 # |-------LARGER-------|
@@ -338,6 +1463,143 @@ def insert_info_into_list(info, global_list):
     # More than everything in the list!
     global_list.append(info)
 
+class ChangeIndex:
+    """The ChangeInformation ranges of a test in list order, alongside the
+    running maxima of their fromchange and tochange dates.  The running
+    maxima never decrease, so the first range insert_info_into_list would
+    stop at can be found by bisection rather than by walking the list from
+    the start."""
+    def __init__(self):
+        self.changes = []
+        self.from_bounds = []
+        self.to_bounds = []
+    def __len__(self):
+        return len(self.changes)
+    def __iter__(self):
+        return iter(self.changes)
+    def __getitem__(self, i):
+        return self.changes[i]
+    def first_candidate(self, info):
+        # Every range before the first one that ends at or after INFO
+        # starts or that starts after INFO ends is skipped over.  Ranges
+        # needn't start before they end: push ids are sorted as strings.
+        return min(bisect.bisect_left(self.to_bounds, info.fromchange.date),
+                   bisect.bisect_right(self.from_bounds, info.tochange.date))
+    def replace(self, i, j, items):
+        if j - i == 1 and len(items) > 1:
+            stats.count('range splits')
+        self.changes[i:j] = items
+        for (bounds, revision) in [(self.from_bounds, lambda c: c.fromchange),
+                                   (self.to_bounds, lambda c: c.tochange)]:
+            bound = bounds[i-1] if i > 0 else None
+            new_bounds = []
+            for c in items:
+                date = revision(c).date
+                if bound is None or bound < date:
+                    bound = date
+                new_bounds.append(bound)
+            bounds[i:j] = new_bounds
+            # Fix up the running maximum after the replaced slice until it
+            # agrees with what was there before.
+            for k in xrange(i + len(items), len(self.changes)):
+                date = revision(self.changes[k]).date
+                if bound is None or bound < date:
+                    bound = date
+                if bounds[k] == bound:
+                    break
+                bounds[k] = bound
+
+def insert_info_into_index(info, index):
+    """Insert INFO into the ChangeIndex INDEX, splitting and merging ranges
+    exactly as insert_info_into_list does."""
+    i = index.first_candidate(info)
+    while i < len(index):
+        point = index[i]
+
+        # Every revision is less than the current point
+        if info.tochange < point.fromchange:
+            index.replace(i, i, [info])
+            return
+        # Every revision is more than the current point
+        if info.fromchange > point.tochange:
+            i += 1
+            continue
+
+        # Now the interesting cases
+        if info.fromchange == point.fromchange:
+            if info.tochange < point.tochange:
+                # |-----INFO----|
+                # |-------POINT------|
+                lower = ChangeInformation(merge_deltas(info, point),
+                                          info.fromchange, info.tochange)
+                upper = ChangeInformation(point.deltas, info.tochange, point.tochange)
+                stats.count('range splits')
+                index.replace(i, i+1, [lower])
+                insert_info_into_index(upper, index)
+                return
+            elif info.tochange == point.tochange:
+                # Unlikely, but merge the platform information for these.
+                point.deltas = merge_deltas(info, point)
+                return
+            else:
+                # |---------INFO-----------|
+                # |----POINT----|
+                lower = ChangeInformation(merge_deltas(info, point),
+                                          point.fromchange, point.tochange)
+                upper = ChangeInformation(info.deltas, point.tochange, info.tochange)
+                # Yes, really.
+                if point.fromchange == point.tochange:
+                    index.replace(i, i+1, [lower, upper])
+                else:
+                    stats.count('range splits')
+                    index.replace(i, i+1, [lower])
+                    insert_info_into_index(upper, index)
+                return
+        elif info.fromchange == point.tochange and info.fromchange.same_node(point.tochange):
+            i += 1
+            continue
+        elif info.fromchange > point.fromchange:
+            if info.tochange < point.tochange:
+                #     |-----INFO----|
+                # |--------POINT---------|
+                index.replace(i, i+1, subsumed_three_way_split(info, point))
+                return
+            elif info.tochange == point.tochange:
+                lower = ChangeInformation(point.deltas,
+                                          point.fromchange, info.fromchange)
+                upper = ChangeInformation(merge_deltas(info, point),
+                                          info.fromchange, info.tochange)
+                index.replace(i, i+1, [lower, upper])
+                return
+            else:
+                #      |-------INFO--------|
+                # |--------POINT------|
+                index.replace(i, i+1, offset_three_way_split(point, info))
+                return
+        elif info.tochange > point.tochange:
+            assert info.fromchange < point.fromchange
+            # |--------INFO-----------|
+            #    |-----POINT-----|
+            index.replace(i, i+1, subsumed_three_way_split(point, info))
+            return
+        elif info.tochange == point.tochange:
+            assert info.fromchange < point.fromchange
+            # |-------INFO--------|
+            #     |---POINT-------|
+            lower = ChangeInformation(info.deltas, info.fromchange, point.fromchange)
+            upper = ChangeInformation(merge_deltas(info, point),
+                                      point.fromchange, point.tochange)
+            index.replace(i, i+1, [lower, upper])
+            return
+        else:
+            # |--------INFO------|
+            #      |------POINT------|
+            index.replace(i, i+1, offset_three_way_split(info, point))
+            return
+
+    # More than everything in the list!
+    index.replace(len(index), len(index), [info])
+
 def collect_platforms(changes):
     platforms = set()
     for c in changes:
@@ -389,71 +1651,174 @@ class TableChangeCell:
 row_template = string.Template('<tr>${cells}</tr>')
 
 class TableChangeRow:
-    def __init__(self, fromchange, tochange):
+    def __init__(self, fromchange, tochange, pushloghtml=m_i_pushloghtml):
         self.fromchange = fromchange
         self.tochange = tochange
+        self.pushloghtml = pushloghtml
         self.cells = []
+        self.cells_by_platform = {}
     def add_cell(self, platform, delta):
-        self.cells.append(TableChangeCell(platform, delta))
+        cell = TableChangeCell(platform, delta)
+        self.cells.append(cell)
+        self.cells_by_platform.setdefault(platform, cell)
+        return cell
     def cell_for_platform(self, platform):
-        for c in self.cells:
-            if platform == c.platform:
-                return c
-        return None
+        return self.cells_by_platform.get(platform)
     def output_html(self):
-        url = m_i_pushloghtml % (self.fromchange, self.tochange)
+        url = self.pushloghtml % (self.fromchange, self.tochange)
         tds = ['<td><a href="%s">%s to %s</a></td>' % (url, self.fromchange, self.tochange)]
         tds.extend([c.output_html() for c in self.cells])
         return row_template.substitute({ 'cells': '\n'.join(tds) })
 
-def try_increase_rowspan_of_previous_cell(rows, platform, delta):
-    for r in reversed(rows):
-        cell = r.cell_for_platform(platform)
-        if cell is not None:
-            if str(cell.delta) == str(delta):
-                cell.rowspan += 1
-                return True
-            return False
-    return False
+def same_delta(x, y):
+    # Deltas display the same if their signs and amounts print the same.
+    if x is None or y is None:
+        return False
+    return x.sign == y.sign and (x.amount == y.amount or str(x.amount) == str(y.amount))
 
-def build_table_structure(platforms, changes):
+def build_table_structure(platforms, changes, tree=default_tree):
     table_rows = []
+    # The cell most recently added for each platform, which a delta in a
+    # later row might extend.
+    last_cells = {}
     for c in changes:
-        current = TableChangeRow(c.fromchange, c.tochange)
+        current = TableChangeRow(c.fromchange, c.tochange, tree.pushloghtml)
+        deltas = {}
+        for d in c.deltas:
+            deltas.setdefault(d.platform, d)
         for p in platforms:
-            inserted_cell = False
-            for d in c.deltas:
-                if d.for_platform(p):
-                    # Try to make the cells maximally large for any
-                    # given delta.  See if this ought to combine with
-                    # some previous row.
-                    if not try_increase_rowspan_of_previous_cell(table_rows, p, d):
-                        current.add_cell(p, d)
-                    inserted_cell = True
-                    break
-            if not inserted_cell:
-                current.add_cell(p, None)
+            d = deltas.get(p)
+            if d is not None:
+                # Try to make the cells maximally large for any
+                # given delta.  See if this ought to combine with
+                # some previous row.
+                cell = last_cells.get(p)
+                if cell is not None and same_delta(cell.delta, d):
+                    cell.rowspan += 1
+                else:
+                    last_cells[p] = current.add_cell(p, d)
+            else:
+                last_cells[p] = current.add_cell(p, None)
         table_rows.append(current)
     return table_rows
 
-def output_cumulative_row(platforms, rows):
-    cumulative = [100.0] * len(platforms)
+def delta_entries(platforms, rows):
+    """Return the row, column, percentage change and whether it is a
+    regression of every change shown in ROWS, in row order, where the
+    columns are those of PLATFORMS.  A change spanning several rows is only
+    shown in the first of them."""
+    column = dict([(p, i) for (i, p) in enumerate(platforms)])
+    entries = []
+    for (n, r) in enumerate(rows):
+        for cell in r.cells:
+            d = cell.delta
+            if d is not None:
+                entries.append((n, column[cell.platform], d.percentage(), d.regression))
+    return entries
+
+def table_statistics(platforms, rows):
+    """Return a dictionary of statistics about the changes in ROWS, each a
+    list with an entry for every platform in PLATFORMS:
+
+    cumulative       -- the score after every change, starting from 100
+    geometric_mean   -- the geometric mean of the changes, as a percentage
+    regressions      -- the number of regressions
+    improvements     -- the number of improvements
+    worst_regression -- the regression of the largest size, as a percentage
+
+    Entries are None where a platform has nothing to report.  Changes not
+    known to be regressions or improvements count as neither."""
+    entries = delta_entries(platforms, rows)
+    if numpy is not None and len(rows) != 0:
+        return numpy_table_statistics(len(platforms), len(rows), entries)
 
-    for r in rows:
-        for (i, p) in enumerate(platforms):
-            cell = r.cell_for_platform(p)
-            if cell and cell.delta is not None:
-                amount = 1.0 + float("%s%s" % (cell.delta.sign, cell.delta.amount))/100.0
-                cumulative[i] *= amount
-
-    c_row = ["<td>Cumulative score baseline=100</td>"]
-    def format_cell(amount):
-        cell = '<td align=center class="%s">%.02f</td>'
-        return cell % ("plus" if amount > 100 else "minus", amount)
-    c_row.extend([format_cell(amount)  for amount in cumulative])
-    return "<tr>" + "".join(c_row) + "</tr>"
-
-html_page_template = string.Template("""
+    cumulative = [100.0] * len(platforms)
+    n_changes = [0] * len(platforms)
+    regressions = [0] * len(platforms)
+    improvements = [0] * len(platforms)
+    worst_regression = [None] * len(platforms)
+    for (row, i, amount, regression) in entries:
+        cumulative[i] *= 1.0 + amount/100.0
+        n_changes[i] += 1
+        if regression:
+            regressions[i] += 1
+            if worst_regression[i] is None or abs(amount) > abs(worst_regression[i]):
+                worst_regression[i] = amount
+        elif regression is not None:
+            improvements[i] += 1
+    geometric_mean = [None] * len(platforms)
+    for (i, n) in enumerate(n_changes):
+        if n != 0:
+            geometric_mean[i] = ((cumulative[i] / 100.0) ** (1.0 / n) - 1.0) * 100.0
+    return { 'cumulative': cumulative,
+             'geometric_mean': geometric_mean,
+             'regressions': regressions,
+             'improvements': improvements,
+             'worst_regression': worst_regression }
+
+def numpy_table_statistics(n_platforms, n_rows, entries):
+    changes = numpy.empty((n_rows, n_platforms))
+    changes.fill(numpy.nan)
+    regression = numpy.zeros((n_rows, n_platforms), dtype=bool)
+    improvement = numpy.zeros((n_rows, n_platforms), dtype=bool)
+    if len(entries) != 0:
+        (row_indices, columns, amounts, kinds) = zip(*entries)
+        cells = (numpy.array(row_indices), numpy.array(columns))
+        changes[cells] = amounts
+        regression[cells] = [kind is True for kind in kinds]
+        improvement[cells] = [kind is False for kind in kinds]
+    present = ~numpy.isnan(changes)
+    factors = numpy.where(present, 1.0 + changes/100.0, 1.0)
+    # Multiplying down from a row of 100s keeps the products in the same
+    # order as the plain Python version, and so the same to the last bit.
+    cumulative = numpy.vstack([numpy.repeat(100.0, n_platforms), factors]).prod(axis=0)
+    n_changes = present.sum(axis=0)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        geometric_mean = ((cumulative / 100.0) ** (1.0 / n_changes) - 1.0) * 100.0
+    # argmax takes the first of equal sizes, as the plain version does.
+    worst_rows = numpy.where(regression, numpy.abs(changes), -1.0).argmax(axis=0)
+    worst_regression = changes[worst_rows, numpy.arange(n_platforms)]
+
+    def optional(values, known):
+        return [v if k else None for (v, k) in zip(values.tolist(), known.tolist())]
+    return { 'cumulative': cumulative.tolist(),
+             'geometric_mean': optional(geometric_mean, n_changes != 0),
+             'regressions': regression.sum(axis=0).tolist(),
+             'improvements': improvement.sum(axis=0).tolist(),
+             'worst_regression': optional(worst_regression, regression.any(axis=0)) }
+
+def cumulative_scores(platforms, rows):
+    return table_statistics(platforms, rows)['cumulative']
+
+def summary_cell(text, klass=None):
+    if text is None:
+        return "<td></td>"
+    if klass is None:
+        return "<td align=center>%s</td>" % text
+    return '<td align=center class="%s">%s</td>' % (klass, text)
+
+def summary_row(label, cells):
+    return "<tr>" + "".join(["<td>%s</td>" % label] + cells) + "</tr>"
+
+def output_summary_rows(platforms, rows):
+    statistics = table_statistics(platforms, rows)
+    def signed_cell(amount, neutral):
+        if amount is None:
+            return summary_cell(None)
+        return summary_cell("%+.2f%%" % amount, "plus" if amount > neutral else "minus")
+    return "\n".join([
+        summary_row("Cumulative score baseline=100",
+                    [summary_cell("%.02f" % amount, "plus" if amount > 100 else "minus")
+                     for amount in statistics['cumulative']]),
+        summary_row("Geometric mean change",
+                    [signed_cell(amount, 0) for amount in statistics['geometric_mean']]),
+        summary_row("Regressions / improvements",
+                    [summary_cell("%d / %d" % counts)
+                     for counts in zip(statistics['regressions'], statistics['improvements'])]),
+        summary_row("Worst regression",
+                    [signed_cell(amount, 0) for amount in statistics['worst_regression']])])
+
+html_page_header_template = string.Template("""
 <html>
 <head>
   <title>Summary of changes over ${date_range}</title>
@@ -469,9 +1834,21 @@ html_page_template = string.Template("""
 <body>
 <h1>Summary of changes over ${date_range}</h1>
 ${toc}
-${main_body}
+""")
+
+html_page_footer = """
 </body>
-</html>""")
+</html>
+"""
+
+test_block_header_template = string.Template("""<h2><a name="${href}">${test}</a></h2>
+<table border="1">
+""")
+
+test_block_footer = """
+</table>"""
+
+toc_label_template = string.Template('<a href="#${href}">${test}</a>')
 
 all_talos_test_descriptions = [ 'Ts, MED Dirty Profile',
                                 'Ts, MAX Dirty Profile',
@@ -515,20 +1892,35 @@ def talos_test_to_href(talos_test):
     tt = string.maketrans(" ", "-")
     return string.translate(talos_test, tt, ",()").lower()
 
-def subject_regex_for_test(talos_test):
+subject_prefix = "^Talos (?:Regression :\\(|Improvement!) "
+
+def subject_suffix_regex(trees=[default_tree]):
     global platforms
-    tree_of_interest = "Mozilla-Inbound(-Non-PGO)?"
-    test_of_interest = re.escape(talos_test)
+    names = sorted([t.subject_name for t in trees], key=len, reverse=True)
+    tree_of_interest = "(?P<tree>" + '|'.join([re.escape(n) for n in names]) + ")(?P<non_pgo>-Non-PGO)?"
     platform_of_interest = '|'.join([re.escape(p) for p in platforms])
-    return re.compile("^Talos (?:Regression :\\(|Improvement!) " + test_of_interest + r" (?:in|de)crease.*?(" + platform_of_interest + ") " + tree_of_interest + "$")
+    return r" (?:in|de)crease.*?(?P<platform>" + platform_of_interest + ") " + tree_of_interest + "$"
+
+def subject_regex_for_test(talos_test, tree=default_tree):
+    test_of_interest = re.escape(talos_test)
+    return re.compile(subject_prefix + test_of_interest + subject_suffix_regex([tree]))
+
+def combined_subject_regex(talos_tests, trees=[default_tree]):
+    # Longest names first, so that a test whose name is a prefix of
+    # another's never shadows it.
+    names = sorted(talos_tests, key=len, reverse=True)
+    test_of_interest = '|'.join([re.escape(t) for t in names])
+    return re.compile(subject_prefix + "(?P<test>" + test_of_interest + ")" + subject_suffix_regex(trees))
 
 class TalosTest:
-    def __init__(self, talos_test, date_range):
+    def __init__(self, talos_test, date_range, tree=default_tree):
         self.talos_test = talos_test
-        self.subject_regex = subject_regex_for_test(talos_test)
+        self.tree = tree
+        self.subject_regex = subject_regex_for_test(talos_test, tree)
         self.date_range = date_range
         self.begin_date, self.end_date = parse_date_range(date_range)
-        self.changes = []
+        self.changes = ChangeIndex()
+        self.pending = []
         self.n_emails = 0
 
     def process_message(self, msg):
@@ -537,29 +1929,70 @@ class TalosTest:
         if match is None:
             return False
 
-        msg, platform = match
+        msg, platform, _ = match
+        self.add_message(msg, platform)
+        return True
+
+    def add_message(self, msg, platform):
         self.n_emails += 1
-        info = grovel_message_information(msg, platform)
+        info = grovel_message_information(msg, platform, self.tree)
         if info is not None:
-            insert_info_into_list(info, self.changes)
-        return True
+            self.pending.append(info)
 
-    def output_html_table_rows(self):
-        self.end()
+    def add_record(self, record):
+        """Like add_message, for a record made by extract_record."""
+        (platform, msg_date, sign, amount, regression, fromchange, tochange) = record[2:]
+        self.n_emails += 1
+        info = change_information(platform, sign, amount, regression, fromchange, tochange,
+                                  self.tree)
+        if info is not None:
+            self.pending.append(info)
 
-        if len(self.changes) == 0:
-            return (None, self.n_emails, 0)
+    def key(self):
+        return (self.tree.name, self.date_range, self.talos_test)
+
+    def insert_pending(self):
+        # Insertion is left until the table is wanted so that it can happen
+        # in whichever process renders this test.
+        stats.count('ranges inserted', len(self.pending))
+        for info in self.pending:
+            insert_info_into_index(info, self.changes)
+        self.pending = []
+
+    def prepare(self):
+        self.insert_pending()
+        self.end()
 
+    def snapshot(self):
+        """Return a copy of this test that can be prepared and rendered
+        without disturbing the changes gathered so far, which end()
+        rearranges."""
+        self.insert_pending()
+        snapshot = copy.copy(self)
+        snapshot.changes = [ChangeInformation(c.deltas, c.fromchange, c.tochange)
+                            for c in self.changes]
+        snapshot.pending = []
+        return snapshot
+
+    def table(self):
+        """Return the platforms and rows of this test's table.  The test
+        must already have been prepared."""
         platforms = collect_platforms(self.changes)
         platforms = [x for x in platforms]
         platforms.sort()
-
-        rows = [output_header_row(platforms)]
-        structure = build_table_structure(platforms, self.changes)
-        rows.extend([r.output_html() for r in structure])
-        rows.append(output_cumulative_row(platforms, structure))
-
-        return (rows, self.n_emails, len(self.changes))
+        return (platforms, build_table_structure(platforms, self.changes, self.tree))
+
+    def write_html_table_rows(self, f):
+        """Write the rows of this test's table to F, which must already have
+        been prepared and have changes to show."""
+        (platforms, structure) = self.table()
+        f.write(output_header_row(platforms))
+        stats.count('rows rendered', len(structure))
+        for r in structure:
+            f.write('\n')
+            f.write(r.output_html())
+        f.write('\n')
+        f.write(output_summary_rows(platforms, structure))
 
     def end(self):
         # Cleanup by removing from == to changes.
@@ -580,66 +2013,728 @@ class TalosTest:
             last.deltas = merge_deltas(c, last)
         self.changes = temp
 
+class MessageDispatcher:
+    """Route messages to the TalosTest they describe, parsing each message's
+    headers once and matching its subject against a single regex covering
+    every test, rather than asking each test in turn.
+
+    A test may be given for several date ranges, in which case a message
+    goes to every one of them whose range it falls in.
+
+    Matched messages are held back until finish(), so that the pushlog
+    information for all of them can be fetched in parallel first.  Only a
+    record of each message, made by extract_record, is held, and records
+    made elsewhere, such as in the processes scanning pieces of a mailbox,
+    can be given to process_record directly."""
+    def __init__(self, tests):
+        self.tests = {}
+        for t in tests:
+            self.tests.setdefault((t.tree.subject_name, t.talos_test), []).append(t)
+        self.windows = dict([(key, [(t.begin_date, t.end_date) for t in ts])
+                             for (key, ts) in self.tests.items()])
+        self.trees = dict([(t.tree.subject_name, t.tree) for t in tests])
+        trees = dict([(t.tree.name, t.tree) for t in tests]).values()
+        self.subject_regex = combined_subject_regex(set([t.talos_test for t in tests]), trees)
+        self.begin_date = min([t.begin_date for t in tests])
+        self.end_date = max([t.end_date for t in tests])
+        self.pending = []
+
+    def criteria(self):
+        """Return the arguments extract_record needs after the message."""
+        return (self.begin_date, self.end_date, self.subject_regex,
+                self.windows, self.trees)
+
+    def process_message(self, msg):
+        record = extract_record(msg, *self.criteria())
+        if record is None:
+            return False
+        return self.process_record(record)
+
+    def process_record(self, record):
+        msg_date = record[3]
+        tests = [t for t in self.tests.get(record[:2], [])
+                 if t.begin_date < msg_date and msg_date < t.end_date]
+        for test in tests:
+            self.pending.append((test, record))
+        return len(tests) != 0
+
+    def finish(self, fetch_jobs=1):
+        if fetch_jobs > 1:
+            with stats.stage('pushlog prefetch'):
+                ranges = [(test.tree, record[7], record[8], record[3])
+                          for (test, record) in self.pending]
+                json_cache.prefetch([r for r in ranges if r[1] != r[2]], fetch_jobs)
+        with stats.stage('pushlog lookup'):
+            for (test, record) in self.pending:
+                test.add_record(record)
+        self.pending = []
+
+def render_test(test):
+    """Prepare TEST and return its email and range counts along with the
+    rows of its table as a string, or None if it has no changes, the Stats
+    for the work done and its final changes.  This runs in a worker
+    process."""
+    global stats
+    stats = Stats()
+    with stats.stage('insertion and end'):
+        test.prepare()
+    if len(test.changes) == 0:
+        return (test.n_emails, 0, None, stats, test.changes)
+    rows = cStringIO.StringIO()
+    with stats.stage('rendering'):
+        test.write_html_table_rows(rows)
+    return (test.n_emails, len(test.changes), rows.getvalue(), stats, test.changes)
+
+def render_tests(tests, jobs):
+    """Return the result of render_test for every test in TESTS, in order,
+    rendering the tests on JOBS processes."""
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(render_test, tests, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def write_html_page(f, date_range, tests_for_page):
+    """Write the page for TESTS_FOR_PAGE, a list of (test name, test,
+    rendered rows) tuples, to F.  Tests whose rows haven't been rendered
+    already are rendered straight into F."""
+    toc = [toc_label_template.substitute({ 'href': talos_test_to_href(test_name),
+                                           'test': test_name })
+           for (test_name, test, rows) in tests_for_page]
+    f.write(html_page_header_template.substitute({ 'date_range': date_range,
+                                                   'toc': ' | '.join(toc),
+                                                   'plus_color': 'red',
+                                                   'minus_color': 'green' }))
+    for (i, (test_name, test, rows)) in enumerate(tests_for_page):
+        if i != 0:
+            f.write('\n')
+        f.write(test_block_header_template.substitute({ 'href': talos_test_to_href(test_name),
+                                                        'test': test_name }))
+        if rows is not None:
+            f.write(rows)
+        else:
+            test.write_html_table_rows(f)
+        f.write(test_block_footer)
+    f.write(html_page_footer)
+
+def test_data_records(test):
+    """Yield the records describing the final changes of TEST, which must
+    already have been prepared: one for each range, then one summarizing
+    the test with the cumulative scores of its table."""
+    for c in test.changes:
+        deltas = dict([(d.platform, { 'sign': d.sign, 'amount': d.amount,
+                                      'regression': d.regression })
+                       for d in c.deltas])
+        yield { 'kind': 'range',
+                'test': test.talos_test,
+                'fromchange': c.fromchange.node_id,
+                'tochange': c.tochange.node_id,
+                'from_date': c.fromchange.date,
+                'to_date': c.tochange.date,
+                'deltas': deltas }
+    cumulative = {}
+    if len(test.changes) != 0:
+        (platforms, structure) = test.table()
+        cumulative = dict(zip(platforms, cumulative_scores(platforms, structure)))
+    yield { 'kind': 'summary',
+            'test': test.talos_test,
+            'n_emails': test.n_emails,
+            'n_ranges': len(test.changes),
+            'cumulative': cumulative }
+
+def write_jsonl_data(f, date_range, tree, tests):
+    f.write(json.dumps({ 'kind': 'report', 'date_range': date_range,
+                         'tree': tree.name },
+                       sort_keys=True) + '\n')
+    for t in tests:
+        for record in test_data_records(t):
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+csv_data_columns = ['kind', 'test', 'fromchange', 'tochange', 'from_date',
+                    'to_date', 'platform', 'sign', 'amount', 'regression']
+
+def write_csv_data(f, date_range, tree, tests):
+    """Write the changes of TESTS as CSV, one line for each platform of each
+    range, then one for each platform's cumulative score in which AMOUNT
+    holds the score.  REGRESSION is 1 for a regression, 0 for an improvement
+    and empty where that isn't known."""
+    writer = csv.writer(f)
+    writer.writerow(csv_data_columns)
+    for t in tests:
+        for record in test_data_records(t):
+            if record['kind'] == 'range':
+                for platform in sorted(record['deltas'].keys()):
+                    delta = record['deltas'][platform]
+                    writer.writerow(['range', t.talos_test, record['fromchange'],
+                                     record['tochange'], record['from_date'],
+                                     record['to_date'], platform, delta['sign'],
+                                     repr(delta['amount']),
+                                     { True: 1, False: 0 }.get(delta['regression'], '')])
+            else:
+                for platform in sorted(record['cumulative'].keys()):
+                    writer.writerow(['cumulative', t.talos_test, '', '', '', '',
+                                     platform, '', repr(record['cumulative'][platform]), ''])
+
+def read_jsonl_data(filename):
+    """Return the date range, tree and prepared TalosTests described by a
+    file written by write_jsonl_data."""
+    date_range = None
+    tree = default_tree
+    tests = {}
+    names = []
+    def test_named(name):
+        if name not in tests:
+            tests[name] = TalosTest(name, date_range, tree)
+            tests[name].changes = []
+            names.append(name)
+        return tests[name]
+    with open(filename, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record['kind']
+            if kind == 'report':
+                date_range = str(record['date_range'])
+                tree = trees_by_name[record.get('tree', default_tree.name)]
+                continue
+            test = test_named(str(record['test']))
+            if kind == 'range':
+                deltas = frozenset([TalosDelta(str(d['sign']), d['amount'], str(platform),
+                                               d.get('regression'))
+                                    for (platform, d) in record['deltas'].iteritems()])
+                c = ChangeInformation(deltas, str(record['fromchange']),
+                                      str(record['tochange']))
+                c.fromchange.date = record['from_date']
+                c.tochange.date = record['to_date']
+                test.changes.append(c)
+            elif kind == 'summary':
+                test.n_emails = record['n_emails']
+    return (date_range, tree, [tests[name] for name in names])
+
 def build_option_parser():
-    usage = "usage: %prog [options] mailbox-file date-range"
+    usage = "usage: %prog [options] mailbox-file... date-range[,date-range...]\n       %prog [options] --from-data FILE\n       %prog [options] [-t TREE] --import-pushlog FILE\n\nMailboxes may be globs, and may be compressed with gzip, bzip2 or xz."
     parser = optparse.OptionParser(usage=usage)
 
     parser.add_option("-c", "--cache-file", metavar="CACHE",
                       action="store", type="string", dest="cache_file",
-                      help="file to cache json-pushlog information in",
+                      help="sqlite file to cache json-pushlog information in",
                       default=".json_cache")
     parser.add_option("-o", "--output-file", metavar="FILE",
                       action="store", type="string", dest="output_file",
                       help="HTML output file",
                       default="index.html")
+    parser.add_option("-i", "--index-file", metavar="INDEX",
+                      action="store", type="string", dest="index_file",
+                      help="file to keep an index of the mailbox in",
+                      default=None)
+    parser.add_option("-f", "--fetch-jobs", metavar="N",
+                      action="store", type="int", dest="fetch_jobs",
+                      help="number of pushlog requests to make in parallel",
+                      default=8)
+    parser.add_option("--fetch-per-host", metavar="N",
+                      action="store", type="int", dest="fetch_per_host",
+                      help="most pushlog requests to make to one host at once",
+                      default=8)
+    parser.add_option("--import-pushlog", metavar="FILE",
+                      action="store", type="string", dest="import_pushlog",
+                      help="load a dump of a tree's whole pushlog, as json-pushes returns it, into the cache and answer that tree's ranges from it alone",
+                      default=None)
+    parser.add_option("--fetch-missing",
+                      action="store_true", dest="fetch_missing",
+                      help="fetch ranges missing from an imported pushlog rather than leaving them out",
+                      default=False)
+    parser.add_option("--fetch-timeout", metavar="SECONDS",
+                      action="store", type="float", dest="fetch_timeout",
+                      help="how long to wait on a pushlog request before retrying it",
+                      default=60)
+    parser.add_option("-j", "--jobs", metavar="N",
+                      action="store", type="int", dest="jobs",
+                      help="number of processes to scan mailboxes and render tests on",
+                      default=1)
+    parser.add_option("-s", "--state-file", metavar="STATE",
+                      action="store", type="string", dest="state_file",
+                      help="file to keep the results so far in, so that later runs only process new mail",
+                      default=None)
+    # With several trees or date ranges, each gets its own output files.
+    parser.add_option("-w", "--window", metavar="DAYS",
+                      action="append", type="int", dest="windows",
+                      help="also summarize the last DAYS days of the date range, which may be given more than once",
+                      default=[])
+    parser.add_option("-t", "--tree", metavar="TREE",
+                      action="append", type="choice", dest="trees",
+                      choices=[t.name for t in all_trees],
+                      help="tree to summarize, which may be given more than once (default mozilla-inbound)")
+    parser.add_option("-d", "--data-file", metavar="FILE",
+                      action="store", type="string", dest="data_file",
+                      help="also write the computed ranges to FILE, as CSV if its name ends in .csv and as JSON Lines otherwise",
+                      default=None)
+    parser.add_option("--no-html", action="store_false", dest="html",
+                      help="don't write the HTML page",
+                      default=True)
+    parser.add_option("--from-data", metavar="FILE",
+                      action="store", type="string", dest="from_data",
+                      help="write the page from a JSON Lines file written by --data-file instead of reading a mailbox",
+                      default=None)
+    parser.add_option("--watch", metavar="SECONDS",
+                      action="store", type="float", dest="watch",
+                      help="keep running, checking the mailbox for new mail every SECONDS seconds and updating the reports",
+                      default=None)
+    parser.add_option("--serve", metavar="PORT",
+                      action="store", type="int", dest="serve",
+                      help="serve the reports over HTTP on PORT rather than writing them, rendering each test's table as it is asked for",
+                      default=None)
+    parser.add_option("--page-days", metavar="DAYS",
+                      action="store", type="int", dest="page_days",
+                      help="number of days of ranges on each page of a served table",
+                      default=7)
+    parser.add_option("--profile", action="store_true", dest="profile",
+                      help="print how long each stage took and what it did",
+                      default=False)
+    parser.add_option("--profile-json", metavar="FILE",
+                      action="store", type="string", dest="profile_json",
+                      help="write the --profile information to FILE as JSON",
+                      default=None)
 
     return parser
 
-def main():
-    (options, argv) = build_option_parser().parse_args()
+def open_json_cache(options):
+    return JSONCache(options.cache_file, options.fetch_per_host,
+                     options.fetch_timeout, options.fetch_missing)
+
+def report_missing_ranges():
+    if len(json_cache.missing) != 0:
+        print >>sys.stderr, ('%d changeset ranges were left out because they are not in the imported '
+                             'pushlog; use --fetch-missing to fetch them' % len(json_cache.missing))
+
+def import_pushlog(options, parser):
+    if options.trees is not None and len(options.trees) > 1:
+        parser.error("--import-pushlog takes a single tree")
+    tree = trees_by_name[(options.trees or [default_tree.name])[0]]
+    cache = JSONCache(options.cache_file)
+    with open(options.import_pushlog, 'r') as f:
+        (n_pushes, n_changesets) = cache.import_pushlog(tree, json.load(f))
+    cache.save()
+    print 'imported %d pushes and %d changesets of %s into %s' % (n_pushes, n_changesets,
+                                                                  tree.name, options.cache_file)
+
+def summarize_mailbox(options, mbox_files, trees, date_ranges):
+    """Run the mailboxes in MBOX_FILES through every test of every tree in
+    TREES over every range in DATE_RANGES in one pass, returning the
+    prepared tests and, for each test, its email and range counts and its
+    table rows if they have been rendered already."""
     global json_cache
-    json_cache = JSONCache(options.cache_file)
-
-    mbox = mailbox.mbox(argv[0])
-    date_range = argv[1]
-    tests = map(lambda t: TalosTest(t, date_range), all_talos_test_descriptions)
-
-    for msg in mbox.itervalues():
-        for t in tests:
-            if t.process_message(msg):
-                break
+    json_cache = open_json_cache(options)
+
+    tests = [TalosTest(name, date_range, tree)
+             for tree in trees for date_range in date_ranges
+             for name in all_talos_test_descriptions]
+
+    start = 0
+    if options.state_file is not None or options.index_file is not None:
+        # main() only allows these with a single uncompressed mbox.
+        stop = os.path.getsize(mbox_files[0])
+    if options.state_file is not None:
+        state = ReportState(options.state_file, mbox_files[0], trees, date_ranges)
+        state.restore(tests)
+        start = state.offset
+        # The saved offset must not pass a message that is still being
+        # delivered, or the next run would start in the middle of it.
+        stop = mbox_complete_end(mbox_files[0], start, stop)
+
+    dispatcher = MessageDispatcher(tests)
+    messages = records = []
+    if options.index_file is not None:
+        with stats.stage('mbox indexing'):
+            index = MboxIndex(mbox_files[0], options.index_file)
+            index.save()
+        messages = index.messages(dispatcher.begin_date, dispatcher.end_date,
+                                  dispatcher.subject_regex, start, stop)
+    else:
+        # Several pieces to a job keep them all busy when some pieces turn
+        # out to hold more of the messages that matter than others.
+        n_pieces = options.jobs * 4 if options.jobs > 1 else 1
+        if options.state_file is not None:
+            pieces = mbox_pieces(mbox_files[0], n_pieces, start, stop)
+        else:
+            pieces = mailbox_pieces(mbox_files, n_pieces)
+        if len(pieces) > 1 and options.jobs > 1:
+            records = scan_mailbox_records(pieces, dispatcher.criteria(), options.jobs)
+        else:
+            messages = scan_mailboxes(pieces, dispatcher.begin_date,
+                                      dispatcher.end_date, dispatcher.subject_regex)
+    with stats.stage('mbox scan and subject matching'):
+        for msg in messages:
+            dispatcher.process_message(msg)
+        for record in records:
+            dispatcher.process_record(record)
+    dispatcher.finish(options.fetch_jobs)
+    report_missing_ranges()
+    json_cache.save()
 
+    if options.state_file is not None:
+        with stats.stage('saving state'):
+            state.save(tests, stop)
+
+    rendered = []
+    if options.jobs > 1:
+        with stats.stage('rendering on %d processes' % options.jobs):
+            results = render_tests(tests, options.jobs)
+        for (t, (n_emails, n_ranges, rows, worker_stats, changes)) in zip(tests, results):
+            stats.merge(worker_stats)
+            t.pending = []
+            t.changes = changes
+            rendered.append((n_emails, n_ranges, rows))
+    else:
+        # The tables are rendered as the page is written.
+        with stats.stage('insertion and end'):
+            for t in tests:
+                t.prepare()
+                rendered.append((t.n_emails, len(t.changes), None))
+
+    return (tests, rendered)
+
+def output_file_for(filename, tree, trees, date_range, date_ranges):
+    """With several trees or date ranges, each gets its own output files,
+    named by adding the tree's name and the dates to FILENAME before its
+    extension."""
+    (root, ext) = os.path.splitext(filename)
+    if len(trees) > 1:
+        root += '-' + tree.name
+    if len(date_ranges) > 1:
+        (start_date, end_date) = parse_date_range(date_range)
+        last_day = end_date - datetime.date.resolution
+        root += '-%s-%s' % (start_date.strftime('%Y%m%d'), last_day.strftime('%Y%m%d'))
+    return root + ext
+
+@contextlib.contextmanager
+def replacing(filename, mode):
+    """Open a file to write FILENAME's new contents to, which replaces
+    FILENAME once it is complete, so that nothing ever reads half a
+    report."""
+    temporary = filename + '.tmp'
+    with open(temporary, mode, 1 << 16) as f:
+        yield f
+    os.rename(temporary, filename)
+
+def write_reports(options, date_range, tree, output_file, data_file, tests, rendered):
     tests_for_page = []
-    for t in tests:
-        (rows, n_emails, n_ranges) = t.output_html_table_rows()
-        if rows is not None:
-            tests_for_page.append((t.talos_test, rows))
+    for (t, (n_emails, n_ranges, rows)) in zip(tests, rendered):
+        if n_ranges != 0:
+            tests_for_page.append((t.talos_test, t, rows))
             print '%s: %d ranges, %d emails' % (t.talos_test, n_ranges, n_emails)
-    tests_for_page.sort()
-
-    block = string.Template("""<h2><a name="${href}">${test}</a></h2>
-<table border="1">
-${table}
-</table>""")
-    main_body = [block.substitute({ 'href': talos_test_to_href(test_name),
-                                    'test': test_name,
-                                    'table': '\n'.join(rows) })
-                 for (test_name, rows) in tests_for_page]
-    toc_label = string.Template('<a href="#${href}">${test}</a>')
-    toc = [toc_label.substitute({ 'href': talos_test_to_href(test_name),
-                                  'test': test_name })
-           for (test_name, rows) in tests_for_page]
-
-    mapping = { 'date_range': date_range,
-                'toc': ' | '.join(toc),
-                'main_body': '\n'.join(main_body),
-                'plus_color': 'red',
-                'minus_color': 'green' }
-
-    with open(options.output_file, 'w') as f:
-        print >>f, html_page_template.substitute(mapping)
+    tests_for_page.sort(key=lambda x: x[0])
 
+    if data_file is not None:
+        with stats.stage('writing data'):
+            if data_file.endswith('.csv'):
+                with replacing(data_file, 'wb') as f:
+                    write_csv_data(f, date_range, tree, tests)
+            else:
+                with replacing(data_file, 'w') as f:
+                    write_jsonl_data(f, date_range, tree, tests)
+
+    if options.html:
+        with stats.stage('writing the page'):
+            with replacing(output_file, 'w') as f:
+                write_html_page(f, date_range, tests_for_page)
+
+def write_all_reports(options, trees, date_ranges, tests, rendered):
+    """Write the reports for every tree and date range."""
+    for tree in trees:
+        for date_range in date_ranges:
+            if len(trees) > 1 or len(date_ranges) > 1:
+                print '%s, %s:' % (tree.name, date_range)
+            report = [(t, r) for (t, r) in zip(tests, rendered)
+                      if t.tree is tree and t.date_range == date_range]
+            data_file = None
+            if options.data_file is not None:
+                data_file = output_file_for(options.data_file, tree, trees,
+                                            date_range, date_ranges)
+            write_reports(options, date_range, tree,
+                          output_file_for(options.output_file, tree, trees,
+                                          date_range, date_ranges),
+                          data_file,
+                          [t for (t, r) in report], [r for (t, r) in report])
+
+def render_snapshot(test):
+    """Prepare and render a snapshot of TEST, returning the snapshot and
+    its email and range counts and table rows."""
+    snapshot = test.snapshot()
+    snapshot.prepare()
+    rows = None
+    if len(snapshot.changes) != 0:
+        f = cStringIO.StringIO()
+        snapshot.write_html_table_rows(f)
+        rows = f.getvalue()
+    return (snapshot, (snapshot.n_emails, len(snapshot.changes), rows))
+
+def watch_mailbox(options, path, trees, date_ranges):
+    """Summarize the mbox or Maildir at PATH, then keep checking it for new
+    messages every options.watch seconds, and write the reports again
+    whenever any arrive.  Everything gathered so far stays in memory, and
+    only the tests that new messages went to are rendered again."""
+    global json_cache
+    json_cache = open_json_cache(options)
+    follower = None
+    try:
+        while True:
+            if follower is None:
+                follower = mailbox_follower(path)
+                tests = [TalosTest(name, date_range, tree)
+                         for tree in trees for date_range in date_ranges
+                         for name in all_talos_test_descriptions]
+                dispatcher = MessageDispatcher(tests)
+                reports = {}
+
+            start = time.time()
+            messages = follower.new_messages(dispatcher.begin_date, dispatcher.end_date,
+                                             dispatcher.subject_regex)
+            if messages is None:
+                print '%s was rewritten; starting again' % path
+                follower = None
+                continue
+            for msg in messages:
+                dispatcher.process_message(msg)
+            changed = set([test.key() for (test, record) in dispatcher.pending])
+            dispatcher.finish(options.fetch_jobs)
+
+            if len(reports) == 0 or len(changed) != 0:
+                for t in tests:
+                    if t.key() in changed or t.key() not in reports:
+                        reports[t.key()] = render_snapshot(t)
+                snapshots = [reports[t.key()] for t in tests]
+                write_all_reports(options, trees, date_ranges,
+                                  [snapshot for (snapshot, r) in snapshots],
+                                  [r for (snapshot, r) in snapshots])
+                print 'updated %d tests for %d new messages in %.2fs' % (len(changed), len(messages),
+                                                                         time.time() - start)
+                sys.stdout.flush()
+            time.sleep(options.watch)
+    except KeyboardInterrupt:
+        pass
     json_cache.save()
 
+def page_url(test, day=None):
+    query = [('tree', test.tree.name),
+             ('range', test.date_range),
+             ('test', talos_test_to_href(test.talos_test))]
+    if day is not None:
+        query.append(('from', day.isoformat()))
+    return '/test?' + urllib.urlencode(query)
+
+def table_pages(test, page_days):
+    """Split the rows of TEST's table into pages of PAGE_DAYS days each,
+    counted from the start of its date range, and return the first day,
+    start and stop of each page that has any rows, in order.  A row goes
+    on the page of the latest date any range up to it starts at, which
+    never goes down, so each page is a run of the table's rows."""
+    begin = time.mktime(test.begin_date.timetuple())
+    span = page_days * 86400
+    pages = []
+    bound = None
+    for (i, c) in enumerate(test.changes):
+        if bound is None or bound < c.fromchange.date:
+            bound = c.fromchange.date
+        period = max(0, int((bound - begin) // span))
+        if len(pages) != 0 and pages[-1][0] == period:
+            pages[-1][2] = i + 1
+        else:
+            pages.append([period, i, i + 1])
+    return [((test.begin_date + datetime.timedelta(days=period * page_days)).date(), start, stop)
+            for (period, start, stop) in pages]
+
+def page_navigation(test, pages, page, page_days):
+    links = ['<a href="/">All tests</a>']
+    if page > 0:
+        links.append('<a href="%s">previous</a>' % page_url(test, pages[page - 1][0]))
+    first_day = pages[page][0]
+    last_day = min(first_day + datetime.timedelta(days=page_days - 1),
+                   (test.end_date - datetime.date.resolution).date())
+    links.append('%s to %s, page %d of %d' % (first_day.isoformat(), last_day.isoformat(),
+                                             page + 1, len(pages)))
+    if page + 1 < len(pages):
+        links.append('<a href="%s">next</a>' % page_url(test, pages[page + 1][0]))
+    return ' | '.join(links)
+
+class ReportServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serve an index of TESTS, which must already have been prepared, and
+    the table of each test PAGE_DAYS days at a time.  Pages are rendered
+    the first time they are asked for and kept, along with an ETag, for
+    later requests."""
+    daemon_threads = True
+    def __init__(self, address, tests, page_days):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ReportRequestHandler)
+        self.tests = [t for t in tests if len(t.changes) != 0]
+        self.tests_by_key = dict([((t.tree.name, t.date_range, talos_test_to_href(t.talos_test)), t)
+                                  for t in self.tests])
+        self.page_days = page_days
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.tables = {}
+    def page(self, path, query):
+        """Return the ETag and body of the page at PATH with QUERY, raising
+        KeyError if there is no such page."""
+        if path == '/':
+            key = ()
+        elif path == '/test':
+            try:
+                day = query.get('from', [None])[0]
+                if day is not None:
+                    day = datetime.date(*map(int, day.split('-')))
+                key = (query['tree'][0], query['range'][0], query['test'][0], day)
+            except (ValueError, TypeError):
+                raise KeyError(path)
+        else:
+            raise KeyError(path)
+        with self.lock:
+            page = self.pages.get(key)
+        if page is None:
+            f = cStringIO.StringIO()
+            if key == ():
+                self.write_index(f)
+            else:
+                self.write_test_page(f, self.tests_by_key[key[:3]], key[3])
+            body = f.getvalue()
+            page = ('"%s"' % hashlib.md5(body).hexdigest(), body)
+            with self.lock:
+                self.pages[key] = page
+        return page
+    def table(self, test):
+        """Return the platforms of TEST's table, its summary rows, which
+        cover every range rather than a single page, and its pages."""
+        key = test.key()
+        with self.lock:
+            table = self.tables.get(key)
+        if table is None:
+            (platforms, structure) = test.table()
+            table = (platforms, output_summary_rows(platforms, structure),
+                     table_pages(test, self.page_days))
+            with self.lock:
+                self.tables[key] = table
+        return table
+    def write_index(self, f):
+        sections = []
+        for t in self.tests:
+            if len(sections) == 0 or sections[-1][0] != (t.tree, t.date_range):
+                sections.append(((t.tree, t.date_range), []))
+            sections[-1][1].append(t)
+        f.write(html_page_header_template.substitute({ 'date_range': ', '.join(sorted(set([t.date_range for t in self.tests]))),
+                                                       'toc': '',
+                                                       'plus_color': 'red',
+                                                       'minus_color': 'green' }))
+        for ((tree, date_range), tests) in sections:
+            f.write('<h2>%s, %s</h2>\n<ul>\n' % (tree.name, date_range))
+            for t in sorted(tests, key=lambda t: t.talos_test):
+                f.write('<li><a href="%s">%s</a>: %d ranges, %d emails</li>\n'
+                        % (page_url(t), t.talos_test, len(t.changes), t.n_emails))
+            f.write('</ul>\n')
+        f.write(html_page_footer)
+    def write_test_page(self, f, test, day):
+        """Write the page of TEST's table starting on DAY, or its first page
+        if DAY is None."""
+        (platforms, summary_rows, pages) = self.table(test)
+        days = [first_day for (first_day, start, stop) in pages]
+        if day is None:
+            page = 0
+        elif day in days:
+            page = days.index(day)
+        else:
+            raise KeyError(day)
+        navigation = page_navigation(test, pages, page, self.page_days)
+        f.write(html_page_header_template.substitute({ 'date_range': test.date_range,
+                                                       'toc': navigation,
+                                                       'plus_color': 'red',
+                                                       'minus_color': 'green' }))
+        f.write(test_block_header_template.substitute({ 'href': talos_test_to_href(test.talos_test),
+                                                        'test': test.talos_test }))
+        f.write(output_header_row(platforms))
+        (first_day, start, stop) = pages[page]
+        for r in build_table_structure(platforms, test.changes[start:stop], test.tree):
+            f.write('\n')
+            f.write(r.output_html())
+        f.write('\n')
+        f.write(summary_rows)
+        f.write(test_block_footer)
+        f.write('\n<p>%s</p>' % navigation)
+        f.write(html_page_footer)
+
+class ReportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write rather than trickling out headers.
+    wbufsize = -1
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        try:
+            (etag, body) = self.server.page(parts.path, urlparse.parse_qs(parts.query))
+        except KeyError:
+            self.send_error(404)
+            return
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_reports(options, tests):
+    server = ReportServer(('127.0.0.1', options.serve), tests, options.page_days)
+    print 'serving the reports at http://127.0.0.1:%d/' % server.server_address[1]
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = build_option_parser()
+    (options, argv) = parser.parse_args()
+
+    if options.import_pushlog is not None:
+        import_pushlog(options, parser)
+        return
+    if options.page_days < 1:
+        parser.error("--page-days must be at least 1")
+    if options.from_data is not None:
+        (date_range, tree, tests) = read_jsonl_data(options.from_data)
+        trees = [tree]
+        date_ranges = [date_range]
+        rendered = [(t.n_emails, len(t.changes), None) for t in tests]
+    else:
+        if len(argv) < 2:
+            parser.error("a mailbox and a date range are needed")
+        mbox_files = mailbox_files(argv[:-1])
+        single_mailbox = len(mbox_files) == 1 and mailbox_decompressor(mbox_files[0]) is None
+        if ((options.state_file is not None or options.index_file is not None) and
+            (not single_mailbox or os.path.isdir(mbox_files[0]))):
+            parser.error("--state-file and --index-file need a single uncompressed mailbox")
+        if options.watch is not None and not single_mailbox:
+            parser.error("--watch needs a single uncompressed mbox or Maildir")
+        if options.watch is not None and options.serve is not None:
+            parser.error("--watch and --serve can't be used together")
+        trees = [trees_by_name[name] for name in (options.trees or [default_tree.name])]
+        date_ranges = parse_date_ranges(argv[-1], options.windows)
+        if options.watch is not None:
+            watch_mailbox(options, mbox_files[0], trees, date_ranges)
+            return
+        (tests, rendered) = summarize_mailbox(options, mbox_files, trees, date_ranges)
+
+    if options.serve is not None:
+        serve_reports(options, tests)
+        return
+    write_all_reports(options, trees, date_ranges, tests, rendered)
+
+    if options.profile:
+        print stats.summary()
+    if options.profile_json is not None:
+        with open(options.profile_json, 'w') as f:
+            f.write(stats.as_json())
+
 if __name__ == '__main__':
     main()